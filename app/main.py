@@ -15,7 +15,7 @@ from app.models.workflow import init_workflows
 from app.utils.scheduler import init_scheduler
 from app.utils.data_dir import ensure_data_dir
 from app.utils.config import get_config, ensure_config_exists, get_log_level
-from app.models.log import setup_logging, log_system_action
+from app.models.log import setup_logging, log_system_action, shutdown_logging
 
 # 创建应用
 app = FastAPI(
@@ -120,6 +120,12 @@ async def startup_event():
     # 初始化调度器
     init_scheduler()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件"""
+    # 写入缓冲区中尚未落盘的日志
+    shutdown_logging()
+
 if __name__ == "__main__":
     # 移除reload=True以防止命令行窗口交互问题
     # 使用workers和log_level参数优化服务器性能和日志显示
@@ -1,18 +1,49 @@
 import os
 import json
+import base64
 import logging
+import logging.handlers
+import queue
 import uuid
-from datetime import datetime
-from typing import Dict, List, Any, Optional, Union, Tuple
+import heapq
+import time
+import atexit
+import contextlib
+import threading
+import contextvars
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Union, Tuple, Callable
 from pydantic import BaseModel, Field
 
 from app.utils.data_dir import get_data_dir
-from app.utils.config import get_config
+from app.utils.config import get_config, DEFAULT_CONFIG
+from app.models.log_store import SegmentLogStore, iter_json_array, iter_batches
+from app.models.log_sqlite import SQLiteLogStore
+from app.models.log_blob import LogBlobStore
+from app.models.log_search import LogSearchIndex
+from app.models.log_stream import LogBroadcaster, LogSubscription
+from app.models.log_archive import LogArchive
+from app.models.log_stats import LogStats
+from app.models.log_sampler import LogSampler
+from app.utils.file_lock import FileLock
+from app.models.workflow_state import (
+    record_warnings, reset_workflow_warnings, get_all_workflow_states, workflow_states_initialized
+)
 
 # 日志文件路径
 SYSTEM_LOG_FILE_PATH = os.path.join(get_data_dir(), "system_logs.json")
 WORKFLOW_LOG_FILE_PATH = os.path.join(get_data_dir(), "workflow_logs.json")
 
+# 分段日志存储目录，旧版整文件日志会在首次使用时导入
+LOG_DIR_PATH = os.path.join(get_data_dir(), "logs")
+
+# SQLite日志库路径，仅在log_backend为sqlite时使用
+LOG_DB_PATH = os.path.join(LOG_DIR_PATH, "logs.db")
+
+# 日志存储版本标记，记录已完成的迁移，启动时版本已是最新则跳过迁移
+LOG_SCHEMA_FILE = os.path.join(LOG_DIR_PATH, "schema.json")
+LOG_SCHEMA_VERSION = 1
+
 class LogEntry(BaseModel):
     """日志条目模型"""
     id: str
@@ -21,45 +52,508 @@ class LogEntry(BaseModel):
     source: str  # 'system' 或 workflow_id
     message: str
     details: Optional[Dict[str, Any]] = None
+    run_id: Optional[str] = None  # 工作流单次运行的ID，同一次运行的日志共享
 
-def _ensure_logs_file(file_path: str):
-    """确保日志文件存在"""
-    if not os.path.exists(file_path):
-        # 确保目录存在
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        # 创建空的日志文件
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump([], f)
+# 当前线程/协程所属的工作流运行ID，记录日志时自动带上
+_current_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_run_id", default=None)
 
-def init_logs():
-    """初始化日志系统，确保日志文件存在"""
-    _ensure_logs_file(SYSTEM_LOG_FILE_PATH)
-    _ensure_logs_file(WORKFLOW_LOG_FILE_PATH)
-
-def _load_logs(log_type: str = "system") -> List[Dict[str, Any]]:
-    """加载指定类型的日志"""
-    file_path = SYSTEM_LOG_FILE_PATH if log_type == "system" else WORKFLOW_LOG_FILE_PATH
-    _ensure_logs_file(file_path)
+def start_run() -> str:
+    """
+    为当前执行上下文生成新的运行ID，此后在该线程或协程中记录的日志都带有这个ID
+    
+    每次工作流运行都在独立的线程或协程中开始，运行ID不会影响其他运行。
+    
+    Returns:
+        运行ID
+    """
+    run_id = uuid.uuid4().hex
+    _current_run_id.set(run_id)
+    return run_id
+
+def get_run_id() -> Optional[str]:
+    """获取当前执行上下文的运行ID"""
+    return _current_run_id.get()
+
+# 日志详情超过该大小（序列化后的字节数）时单独压缩保存，日志中只保留引用
+LOG_DETAILS_INLINE_MAX_BYTES = 4096
+
+# 日志详情数据块存储，两种日志后端共用
+_blob_store = LogBlobStore(os.path.join(LOG_DIR_PATH, "blobs"))
+
+# 日志全文检索索引，两种日志后端共用
+LOG_SEARCH_DB_PATH = os.path.join(LOG_DIR_PATH, "search.db")
+_search_index = LogSearchIndex(LOG_SEARCH_DB_PATH)
+
+# 日志统计，随日志写入增量更新
+LOG_STATS_FILE_PATH = os.path.join(LOG_DIR_PATH, "stats.json")
+_log_stats = LogStats(LOG_STATS_FILE_PATH)
+
+# 新日志的进程内发布/订阅，用于实时推送
+_broadcaster = LogBroadcaster()
+
+# 各类型日志的存储，首次使用时按配置的后端创建
+_stores: Dict[str, Union[SegmentLogStore, SQLiteLogStore]] = {}
+
+# 各类型日志的冷归档，两种日志后端共用
+_archives: Dict[str, LogArchive] = {}
+
+def _get_archive(log_type: str = "system") -> LogArchive:
+    """获取指定类型日志的归档"""
+    log_type = "system" if log_type == "system" else "workflow"
+    archive = _archives.get(log_type)
+    if archive is None:
+        archive = _archives[log_type] = LogArchive(os.path.join(LOG_DIR_PATH, "archive", log_type))
+    return archive
+
+def _get_store(log_type: str = "system") -> Union[SegmentLogStore, SQLiteLogStore]:
+    """获取指定类型日志的存储，后端由配置项log_backend决定（file或sqlite）"""
+    log_type = "system" if log_type == "system" else "workflow"
+    store = _stores.get(log_type)
+    if store is None:
+        legacy_file = SYSTEM_LOG_FILE_PATH if log_type == "system" else WORKFLOW_LOG_FILE_PATH
+        if get_config().get("log_backend", "file") == "sqlite":
+            store = SQLiteLogStore(LOG_DB_PATH, f"{log_type}_logs")
+            _migrate_to_sqlite(store, log_type, legacy_file)
+        else:
+            store = SegmentLogStore(
+                os.path.join(LOG_DIR_PATH, log_type),
+                legacy_file=legacy_file,
+                index_sources=(log_type == "workflow")
+            )
+        _stores[log_type] = store
+    return store
+
+def _migrate_to_sqlite(store: SQLiteLogStore, log_type: str, legacy_file: str):
+    """
+    一次性将已有日志导入SQLite日志库
+    
+    依次导入旧版整文件JSON日志和分段存储中的日志，导入成功后源文件和分段目录重命名为.bak，
+    之后不会再次导入，即使日志表因清除或压缩变为空。
+    """
+    segment_dir = os.path.join(LOG_DIR_PATH, log_type)
+    if not os.path.exists(legacy_file) and not os.path.isdir(segment_dir):
+        return
+    
+    # 多个进程同时启动时只有一个进程导入；不能使用分段存储自身的锁，读取分段时会再次加锁
+    with FileLock(f"{LOG_DB_PATH}.{log_type}.migrate.lock"):
+        if os.path.exists(legacy_file):
+            try:
+                # SQLite查询按时间排序，流式分批导入即可
+                entries = (entry for entry in iter_json_array(legacy_file) if isinstance(entry, dict))
+                for batch in iter_batches(entries):
+                    store.append_many(batch)
+                os.replace(legacy_file, _backup_path(legacy_file))
+            except Exception as e:
+                logging.error(f"迁移{log_type}日志文件到SQLite失败: {str(e)}")
+        
+        if os.path.isdir(segment_dir):
+            try:
+                for batch in iter_batches(SegmentLogStore(segment_dir, index_sources=False).iter_entries()):
+                    store.append_many(batch)
+                os.replace(segment_dir, _backup_path(segment_dir))
+            except Exception as e:
+                logging.error(f"迁移{log_type}分段日志到SQLite失败: {str(e)}")
+
+def _backup_path(path: str) -> str:
+    """迁移后源文件或目录的备份路径，已有备份时附加时间戳"""
+    backup = path + ".bak"
+    if os.path.exists(backup):
+        backup = f"{path}.{datetime.now().strftime('%Y%m%d%H%M%S')}.bak"
+    return backup
+
+# 日志缓冲区参数
+LOG_BUFFER_MAX_SIZE = 10000  # 缓冲区上限，超过后由写入方同步刷新
+LOG_BUFFER_FLUSH_SIZE = 200  # 缓冲达到该数量时唤醒后台线程刷新
+LOG_BUFFER_FLUSH_INTERVAL = 1.0  # 后台线程定时刷新间隔（秒）
+
+# 正在写入日志的线程，这些线程中产生的Python日志只输出到控制台，避免日志写入再次触发日志写入
+_log_write_state = threading.local()
+
+@contextlib.contextmanager
+def _log_write_guard():
+    """标记当前线程正在写入日志"""
+    previous = getattr(_log_write_state, "active", False)
+    _log_write_state.active = True
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        # 如果文件损坏，创建新的空日志
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump([], f)
-        return []
-    except Exception as e:
-        logging.error(f"加载日志文件失败: {str(e)}")
-        return []
+        yield
+    finally:
+        _log_write_state.active = previous
 
-def _save_logs(logs: List[Dict[str, Any]], log_type: str = "system"):
-    """保存指定类型的日志"""
-    file_path = SYSTEM_LOG_FILE_PATH if log_type == "system" else WORKFLOW_LOG_FILE_PATH
+class LogBuffer:
+    """
+    日志内存缓冲区
+
+    add_log只把日志放入缓冲区，由后台线程按数量或时间批量写入分段存储，
+    调用方不需要等待文件I/O。写入存储失败的日志放回缓冲区前部，下次刷新时重试；
+    缓冲区容纳不下的部分丢弃最早的日志，丢弃数量记录在统计中。
+    """
+
+    def __init__(self, max_size: int = LOG_BUFFER_MAX_SIZE, flush_size: int = LOG_BUFFER_FLUSH_SIZE,
+                 flush_interval: float = LOG_BUFFER_FLUSH_INTERVAL,
+                 before_flush: Optional[Callable[[], None]] = None):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # 后台线程每次刷新前调用，用于放入定时产生的日志
+        self.before_flush = before_flush
+        self._pending: Dict[str, List[Dict[str, Any]]] = {"system": [], "workflow": []}
+        self._depth = 0
+        self._cond = threading.Condition()
+        # 保证批次按顺序写入，允许同一线程在刷新过程中再次刷新
+        self._flush_lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        # 刷新统计
+        self._flush_count = 0
+        self._flushed_total = 0
+        self._last_flush_latency = 0.0
+        self._max_flush_latency = 0.0
+        self._last_flush_at: Optional[str] = None
+        self._failed_flushes = 0
+        self._dropped_total = 0
+        # 上次刷新有写入失败时，后台线程等待一个刷新间隔再重试
+        self._retry_wait = False
+
+    def put(self, log_type: str, entry: Dict[str, Any]):
+        """放入一条日志，缓冲区已满时在当前线程同步刷新"""
+        with self._cond:
+            self._pending[log_type].append(entry)
+            self._depth += 1
+            depth = self._depth
+            if depth >= self.flush_size:
+                self._cond.notify()
+        self._ensure_thread()
+        if depth >= self.max_size:
+            self.flush()
+
+    def flush(self) -> int:
+        """将缓冲区中的日志写入存储，返回写入的数量"""
+        with self._flush_lock, _log_write_guard():
+            with self._cond:
+                if not self._depth:
+                    return 0
+                pending = self._pending
+                self._pending = {"system": [], "workflow": []}
+                self._depth = 0
+
+            start = time.perf_counter()
+            written = 0
+            self._retry_wait = False
+            for log_type, entries in pending.items():
+                if not entries:
+                    continue
+                try:
+                    _write_entries(log_type, entries)
+                    written += len(entries)
+                except Exception as e:
+                    # 写入失败时不能再经由日志系统记录，直接输出到控制台
+                    print(f"写入{log_type}日志失败: {str(e)}")
+                    self._requeue(log_type, entries)
+            latency = time.perf_counter() - start
+
+            self._flush_count += 1
+            self._flushed_total += written
+            self._last_flush_latency = latency
+            self._max_flush_latency = max(self._max_flush_latency, latency)
+            self._last_flush_at = datetime.now().isoformat()
+            return written
+
+    def _requeue(self, log_type: str, entries: List[Dict[str, Any]]):
+        """将写入失败的日志放回缓冲区前部，超出容量的部分丢弃最早的日志"""
+        with self._cond:
+            room = max(self.max_size - self._depth, 0)
+            kept = entries[len(entries) - room:] if room < len(entries) else entries
+            self._pending[log_type] = kept + self._pending[log_type]
+            self._depth += len(kept)
+            self._failed_flushes += 1
+            self._dropped_total += len(entries) - len(kept)
+            self._retry_wait = True
+
+    def _ensure_thread(self):
+        if self._thread is not None or self._stopping:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """后台刷新线程"""
+        while True:
+            with self._cond:
+                if not self._stopping and (self._depth < self.flush_size or self._retry_wait):
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            if self.before_flush is not None:
+                try:
+                    self.before_flush()
+                except Exception as e:
+                    print(f"日志刷新前处理失败: {str(e)}")
+            self.flush()
+            if stopping:
+                break
+
+    def stop(self):
+        """停止后台线程并写入剩余日志"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓冲区状态：队列深度和刷新耗时"""
+        with self._cond:
+            depth = self._depth
+        return {
+            "queue_depth": depth,
+            "max_size": self.max_size,
+            "flush_count": self._flush_count,
+            "flushed_total": self._flushed_total,
+            "last_flush_latency_ms": round(self._last_flush_latency * 1000, 3),
+            "max_flush_latency_ms": round(self._max_flush_latency * 1000, 3),
+            "last_flush_at": self._last_flush_at,
+            "failed_flushes": self._failed_flushes,
+            "dropped_total": self._dropped_total,
+            "flusher_running": self._thread is not None and self._thread.is_alive(),
+        }
+
+_log_buffer = LogBuffer()
+
+# 重复日志抑制，参数由配置项log_sampling设置
+_log_sampler = LogSampler()
+
+def _configure_log_sampler():
+    """按配置更新重复日志抑制参数"""
+    sampling = {**DEFAULT_CONFIG["log_sampling"], **(get_config().get("log_sampling") or {})}
+    _log_sampler.configure(
+        window_seconds=sampling.get("window_seconds") or 60,
+        burst=sampling.get("burst") or 10,
+        sample_every=sampling.get("sample_every") or 0,
+        enabled=sampling.get("enabled", True)
+    )
+
+def _emit_log_rollups(force: bool = False):
+    """将被省略的重复日志汇总为一条日志写入"""
+    for rollup in _log_sampler.drain(force):
+        _submit_log(
+            rollup["level"],
+            rollup["source"],
+            rollup["message"],
+            rollup["details"],
+            datetime.now().isoformat(),
+            rollup["run_id"]
+        )
+
+_log_buffer.before_flush = _emit_log_rollups
+
+def _offload_details(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """详情过大时存入数据块存储，返回以details_ref引用数据块的日志"""
+    details = entry.get("details")
+    if details is None:
+        return entry
+    data = json.dumps(details, ensure_ascii=False).encode("utf-8")
+    if len(data) <= LOG_DETAILS_INLINE_MAX_BYTES:
+        return entry
+    return {**entry, "details": None, "details_ref": _blob_store.put(data), "details_size": len(data)}
+
+def _write_entries(log_type: str, entries: List[Dict[str, Any]]):
+    """将一批日志写入对应的存储，保留策略由后台压缩任务执行"""
+    _get_store(log_type).append_many([_offload_details(entry) for entry in entries])
+    _after_write(log_type, entries)
+
+def _after_write(log_type: str, entries: List[Dict[str, Any]]):
+    """日志写入存储后更新检索索引、统计和工作流警告状态"""
+    # 检索索引使用未拆分的详情，索引失败不影响日志写入
+    try:
+        _search_index.add("system" if log_type == "system" else "workflow", entries)
+    except Exception as e:
+        print(f"更新日志检索索引失败: {str(e)}")
+    
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
+        _log_stats.add("system" if log_type == "system" else "workflow", entries)
     except Exception as e:
-        logging.error(f"保存日志文件失败: {str(e)}")
+        print(f"更新日志统计失败: {str(e)}")
+    
+    # 更新工作流的警告状态，仪表盘直接读取，无需查询日志
+    if log_type == "workflow":
+        warnings: Dict[str, List[str]] = {}
+        for entry in entries:
+            if entry.get("level") == "warning":
+                warnings.setdefault(entry.get("source"), []).append(entry.get("timestamp"))
+        if warnings:
+            try:
+                record_warnings(warnings)
+            except Exception as e:
+                print(f"更新工作流警告状态失败: {str(e)}")
+
+def flush_logs() -> int:
+    """
+    立即写入缓冲区中的全部日志
+    
+    只输出时间窗口已结束的重复日志汇总；查询日志前也会调用，强制输出会使汇总数量随查询次数增长，
+    未结束的窗口在应用退出时输出。
+    """
+    _emit_log_rollups()
+    return _log_buffer.flush()
+
+def shutdown_logging():
+    """停止日志监听线程和后台刷新线程并写入剩余日志，应用退出时调用"""
+    _stop_log_listener()
+    _emit_log_rollups(force=True)
+    _log_buffer.stop()
+    _log_stats.save(force=True)
+
+def get_log_buffer_stats() -> Dict[str, Any]:
+    """获取日志缓冲区的队列深度和刷新耗时，以及重复日志抑制的状态"""
+    return {**_log_buffer.stats(), "sampler": _log_sampler.stats()}
+
+atexit.register(shutdown_logging)
+
+def init_logs():
+    """初始化日志系统，确保日志存储可用"""
+    _get_store("system").count()
+    _get_store("workflow").count()
+    _init_workflow_warning_states()
+    _init_search_index()
+    _init_log_stats()
+
+def _init_log_stats():
+    """统计文件不存在时，根据已有日志（包括归档）生成统计"""
+    if _log_stats.exists():
+        return
+    for log_type in ("system", "workflow"):
+        for batch in iter_batches(_get_archive(log_type).iter_range()):
+            _log_stats.add(log_type, batch)
+        for batch in iter_batches(_get_store(log_type).iter_entries()):
+            _log_stats.add(log_type, batch)
+    _log_stats.save(force=True)
+
+def _init_search_index():
+    """检索索引不存在时，为已有日志建立索引"""
+    if os.path.exists(LOG_SEARCH_DB_PATH):
+        return
+    for log_type in ("system", "workflow"):
+        batch = []
+        for entry in _get_store(log_type).iter_entries():
+            batch.append(entry)
+            if len(batch) >= 1000:
+                _search_index.add(log_type, batch)
+                batch = []
+        _search_index.add(log_type, batch)
+
+def _init_workflow_warning_states():
+    """首次使用工作流状态时，根据已有的警告日志初始化各工作流的警告标记"""
+    if workflow_states_initialized():
+        return
+    store = _get_store("workflow")
+    warnings: Dict[str, List[str]] = {}
+    warning_logs, _ = store.query(None, "warning", 0, store.count(None, "warning"))
+    for log in reversed(warning_logs):
+        warnings.setdefault(log.get("source"), []).append(log.get("timestamp"))
+    record_warnings(warnings)
+
+# 日志级别对应的数值，与Python内置日志系统一致
+_LEVEL_NUMBERS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+# 日志系统初始化前不过滤，全部记录
+_logging_configured = False
+
+def is_log_enabled(level: str) -> bool:
+    """
+    指定级别的日志是否会被记录
+    
+    按根日志记录器的级别判断（启动时由log_level配置设置，修改设置后立即生效）。
+    警告和错误日志始终记录，工作流的警告状态依赖它们。
+    
+    Args:
+        level: 日志级别
+    """
+    if not _logging_configured:
+        return True
+    threshold = min(logging.getLogger().getEffectiveLevel(), logging.WARNING)
+    return _LEVEL_NUMBERS.get(level.lower(), logging.INFO) >= threshold
+
+class SystemLogHandler(logging.Handler):
+    """将Python日志记录到系统日志，在日志监听线程中调用"""
+    
+    _LEVEL_MAP = {
+        logging.DEBUG: 'debug',
+        logging.INFO: 'info',
+        logging.WARNING: 'warning',
+        logging.ERROR: 'error',
+        logging.CRITICAL: 'error'
+    }
+    
+    def emit(self, record):
+        try:
+            # 跳过外部库的调试日志，避免它们进入系统日志
+            if record.levelno <= logging.DEBUG and (
+                record.name.startswith('httpx') or 
+                record.name.startswith('httpcore') or
+                record.name.startswith('urllib3')
+            ):
+                return
+            
+            level = self._LEVEL_MAP.get(record.levelno, 'info')
+            if not is_log_enabled(level):
+                return
+            if not _log_sampler.allow(level, "system", record.getMessage(), getattr(record, "run_id", None)):
+                return
+            with _log_write_guard():
+                # 使用日志产生的时间和运行ID，而不是监听线程处理它的时间
+                _submit_log(
+                    level,
+                    "system",
+                    self.format(record),
+                    None,
+                    datetime.fromtimestamp(record.created).isoformat(),
+                    getattr(record, "run_id", None)
+                )
+        except Exception:
+            self.handleError(record)
+
+class _LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    把日志放入队列的处理器
+    
+    在正在写入日志的线程中（日志监听线程、缓冲区刷新线程）产生的日志直接输出到控制台，
+    不再进入队列，防止写入日志时的日志形成循环。
+    """
+    
+    def __init__(self, log_queue: queue.SimpleQueue, console_handler: logging.Handler):
+        super().__init__(log_queue)
+        self.console_handler = console_handler
+    
+    def prepare(self, record):
+        record = super().prepare(record)
+        # 运行ID保存在调用方线程的上下文中，入队前取出
+        record.run_id = _current_run_id.get()
+        return record
+    
+    def emit(self, record):
+        if getattr(_log_write_state, "active", False):
+            if record.levelno >= self.console_handler.level:
+                self.console_handler.handle(record)
+            return
+        super().emit(record)
+
+# 当前的日志监听线程，setup_logging时创建
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def _stop_log_listener():
+    """停止日志监听线程，队列中剩余的日志处理完后返回"""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is not None and listener._thread is not None:
+        listener.stop()
 
 def setup_logging(log_level: str = "INFO"):
     """
@@ -91,152 +585,302 @@ def setup_logging(log_level: str = "INFO"):
     console_handler.setFormatter(formatter)
     
     # 创建自定义处理器，将日志加入到系统日志中
-    class SystemLogHandler(logging.Handler):
-        def emit(self, record):
-            try:
-                # 跳过外部库的调试日志，避免它们进入系统日志
-                if record.levelno <= logging.DEBUG and (
-                    record.name.startswith('httpx') or 
-                    record.name.startswith('httpcore') or
-                    record.name.startswith('urllib3')
-                ):
-                    return
-                
-                level_map = {
-                    logging.DEBUG: 'debug',
-                    logging.INFO: 'info',
-                    logging.WARNING: 'warning',
-                    logging.ERROR: 'error',
-                    logging.CRITICAL: 'error'
-                }
-                level = level_map.get(record.levelno, 'info')
-                message = self.format(record)
-                log_system_action(level, message)
-            except Exception:
-                self.handleError(record)
-    
-    # 添加自定义处理器
     system_handler = SystemLogHandler()
     system_handler.setLevel(numeric_level)
     system_handler.setFormatter(formatter)
     
-    # 将处理器添加到根日志记录器
-    logger.addHandler(console_handler)
-    logger.addHandler(system_handler)
+    # 根日志记录器只把日志放入队列，由监听线程依次交给控制台和系统日志处理器，
+    # 任何线程中的logging调用都不会等待控制台输出或日志写入
+    global _log_listener
+    _stop_log_listener()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(_LogQueueHandler(log_queue, console_handler))
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, console_handler, system_handler, respect_handler_level=True
+    )
+    _log_listener.start()
+    
+    # 确保日志存储可用
+    init_logs()
+    _configure_log_sampler()
     
-    # 确保日志文件存在
-    _ensure_logs_file(SYSTEM_LOG_FILE_PATH)
-    _ensure_logs_file(WORKFLOW_LOG_FILE_PATH)
+    # 此后按日志级别过滤
+    global _logging_configured
+    _logging_configured = True
     
     # 记录日志系统启动信息
     logging.info("日志系统已初始化")
 
-def add_log(level: str, source: str, message: str, details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def add_log(
+    level: str,
+    source: str,
+    message: Union[str, Callable[[], str]],
+    details: Union[Dict[str, Any], Callable[[], Optional[Dict[str, Any]]], None] = None
+) -> Optional[Dict[str, Any]]:
     """
     添加一条日志
     
+    低于当前日志级别的日志在格式化之前直接丢弃。message和details可以传入无参函数，
+    只有日志确实需要记录时才会调用，用于延迟构造开销较大的调试信息。
+    短时间内大量重复的日志只记录一部分，其余的在时间窗口结束后汇总为一条，见LogSampler。
+    
     Args:
         level: 日志级别，如 'debug', 'info', 'warning', 'error'
         source: 日志来源，'system' 或工作流ID
-        message: 日志消息
-        details: 日志的详细数据
+        message: 日志消息，或返回消息的函数
+        details: 日志的详细数据，或返回详细数据的函数
         
     Returns:
-        新添加的日志记录
+        新添加的日志记录，被级别过滤或作为重复日志省略时返回None
     """
     # 规范化日志级别
     level = level.lower()
     if level not in ['debug', 'info', 'warning', 'error']:
         level = 'info'
     
-    # 创建日志条目
+    if not is_log_enabled(level):
+        return None
+    if callable(message):
+        message = message()
+    run_id = _current_run_id.get()
+    if not _log_sampler.allow(level, source, message, run_id):
+        return None
+    if callable(details):
+        details = details()
+    
+    return _submit_log(level, source, message, details, datetime.now().isoformat(), run_id)
+
+def _submit_log(
+    level: str,
+    source: str,
+    message: str,
+    details: Optional[Dict[str, Any]],
+    timestamp: str,
+    run_id: Optional[str]
+) -> Dict[str, Any]:
+    """创建日志条目并放入缓冲区"""
     log_entry = LogEntry(
         id=str(uuid.uuid4()),
-        timestamp=datetime.now().isoformat(),
+        timestamp=timestamp,
         level=level,
         source=source,
         message=message,
-        details=details
+        details=details,
+        run_id=run_id
     ).dict()
     
-    # 确定日志类型和文件
+    # 确定日志类型
     log_type = "system" if source == "system" else "workflow"
     
-    # 添加到对应日志文件
-    logs = _load_logs(log_type)
-    logs.append(log_entry)
-    
-    # 获取日志保留条数配置
-    config = get_config()
-    log_max_entries = config.get("log_max_entries", 10000)
+    # 放入缓冲区，由后台线程批量写入
+    _log_buffer.put(log_type, log_entry)
     
-    # 如果日志太多，保留最新的配置数量条
-    if len(logs) > log_max_entries:
-        logs = logs[-log_max_entries:]
+    # 推送给实时订阅者
+    _broadcaster.publish(log_type, log_entry)
     
-    _save_logs(logs, log_type)
     return log_entry
 
+def _normalize_level(log_level: Optional[str]) -> Optional[str]:
+    """规范化日志级别过滤条件，'all'等值表示不过滤"""
+    if not log_level or log_level.lower() in ["all", "none", ""]:
+        return None
+    return log_level.lower()
+
 def get_logs(
     log_type: str = "system", 
     workflow_id: Optional[str] = None,
     log_level: Optional[str] = None,
     page: int = 1,
-    page_size: int = 50
+    page_size: int = 50,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None
 ) -> Tuple[List[Dict[str, Any]], int]:
     """
     获取日志列表，支持过滤和分页
     
+    已归档的日志只在需要时读取：不限时间时，热存储中的日志不足一页才继续读取归档；
+    指定时间范围时，只读取范围内的归档。
+    
     Args:
         log_type: 日志类型，'system' 或 'workflow'
         workflow_id: 工作流ID，仅当log_type为'workflow'时有效
         log_level: 日志级别过滤
         page: 页码，从1开始
         page_size: 每页记录数
+        start_time: 起始时间（含，ISO格式），仅当log_type为'system'或'workflow'时有效
+        end_time: 结束时间（不含，ISO格式），仅当log_type为'system'或'workflow'时有效
         
     Returns:
         (日志列表, 总记录数)
     """
-    # 根据类型加载日志
-    if log_type == "system":
-        logs = _load_logs("system")
+    # 先写入缓冲区中的日志，保证能查询到刚添加的日志
+    flush_logs()
+    
+    level = _normalize_level(log_level)
+    offset = (page - 1) * page_size
+    
+    if log_type in ("system", "workflow"):
         # 系统日志不需要按工作流ID过滤
-        filtered_logs = logs
-    elif log_type == "workflow":
-        logs = _load_logs("workflow")
-        # 如果指定了工作流ID，则按ID过滤
-        if workflow_id:
-            filtered_logs = [log for log in logs if log.get("source") == workflow_id]
-        else:
-            # 否则返回所有工作流日志
-            filtered_logs = logs
+        source = workflow_id if log_type == "workflow" else None
+        if start_time or end_time:
+            return _get_logs_in_range(log_type, source, level, offset, page_size, start_time, end_time)
+        
+        # 通过来源/级别索引只读取当前页的日志，结果已按写入时间倒序
+        logs, total = _get_store(log_type).query(source, level, offset, page_size)
+        archive = _get_archive(log_type)
+        archive_total = archive.count(source, level)
+        if archive_total and len(logs) < page_size:
+            logs = logs + archive.query(source, level, max(offset - total, 0), page_size - len(logs))
+        return logs, total + archive_total
+    
+    # 如果类型不明确，从两类日志各取前若干条后合并
+    if workflow_id and workflow_id != "system":
+        system_logs, system_total = [], 0
     else:
-        # 如果类型不明确，加载所有日志
-        system_logs = _load_logs("system")
-        workflow_logs = _load_logs("workflow")
-        logs = system_logs + workflow_logs
-        # 如果指定了工作流ID，过滤组合日志
-        if workflow_id:
-            filtered_logs = [log for log in logs if log.get("source") == workflow_id]
+        system_logs, system_total = _get_store("system").query(None, level, 0, offset + page_size)
+    workflow_logs, workflow_total = _get_store("workflow").query(workflow_id, level, 0, offset + page_size)
+    merged = heapq.merge(system_logs, workflow_logs, key=lambda x: x.get("timestamp", ""), reverse=True)
+    return list(merged)[offset:offset + page_size], system_total + workflow_total
+
+def _get_logs_in_range(
+    log_type: str,
+    source: Optional[str],
+    level: Optional[str],
+    offset: int,
+    limit: int,
+    start_time: Optional[str],
+    end_time: Optional[str]
+) -> Tuple[List[Dict[str, Any]], int]:
+    """按时间范围查询日志，先读热存储，范围早于热存储时再读归档，总数需要遍历整个范围"""
+    logs: List[Dict[str, Any]] = []
+    total = 0
+    for entry in _iter_logs_in_range(log_type, source, level, start_time, end_time):
+        if offset <= total < offset + limit:
+            logs.append(entry)
+        total += 1
+    return logs, total
+
+def _iter_logs_in_range(
+    log_type: str,
+    source: Optional[str],
+    level: Optional[str],
+    start_time: Optional[str],
+    end_time: Optional[str]
+):
+    """按时间倒序遍历时间范围内的日志"""
+    store = _get_store(log_type)
+    # 不存在的ID使游标定位到时间早于end_time的位置
+    position = (end_time, "", None) if end_time else None
+    while True:
+        batch, _, positions = store.query_before(source, level, position, 500)
+        if not batch:
+            break
+        for entry in batch:
+            if start_time and entry.get("timestamp", "") < start_time:
+                break
+            yield entry
         else:
-            filtered_logs = logs
+            position = (batch[-1].get("timestamp", ""), batch[-1].get("id", ""), positions[-1])
+            continue
+        break
     
-    # 过滤日志级别
-    if log_level and log_level.lower() not in ["all", "none", ""]:
-        filtered_logs = [log for log in filtered_logs if log.get("level") == log_level.lower()]
+    # 归档中的日志都早于热存储
+    oldest_day = _get_archive(log_type).oldest_day(source)
+    if oldest_day and (end_time is None or oldest_day <= end_time[:10]):
+        yield from _get_archive(log_type).iter_range(source, level, start_time, end_time)
+
+def encode_log_cursor(log: Dict[str, Any], position: Any = None) -> str:
+    """
+    由日志的 (时间, ID) 生成分页游标
     
-    # 总记录数
-    total = len(filtered_logs)
+    Args:
+        log: 上一页的最后一条日志
+        position: 该日志在存储中的位置（query_before返回），分段存储据此精确定位
+    """
+    raw = json.dumps([log.get("timestamp", ""), log.get("id", ""), position], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_log_cursor(cursor: str) -> Tuple[str, str, Any]:
+    """
+    解析分页游标，返回 (时间, ID, 位置)，没有位置的游标位置为None
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        timestamp, log_id = values[0], values[1]
+        position = values[2] if len(values) > 2 else None
+    except Exception:
+        raise ValueError("无效的分页游标")
+    return str(timestamp), str(log_id), position
+
+def get_logs_page(
+    log_type: str = "system",
+    workflow_id: Optional[str] = None,
+    log_level: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: int = 50
+) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+    """
+    按游标获取一页日志，每页的开销与翻到第几页无关
     
-    # 按时间倒序排序
-    filtered_logs.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+    Args:
+        log_type: 日志类型，'system' 或 'workflow'
+        workflow_id: 工作流ID，仅当log_type为'workflow'时有效
+        log_level: 日志级别过滤
+        cursor: 上一页返回的next_cursor，为空时从最新的日志开始
+        page_size: 每页记录数
+        
+    Returns:
+        (日志列表, 下一页游标, 总记录数)，没有更多日志时下一页游标为None
+        
+    Raises:
+        ValueError: 游标格式无效
+    """
+    flush_logs()
     
-    # 分页
-    start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
+    level = _normalize_level(log_level)
+    position = decode_log_cursor(cursor) if cursor else None
     
-    # 返回分页后的日志和总数
-    return filtered_logs[start_idx:end_idx], total
+    # 多取一条用于判断是否还有下一页；positions为每条日志在存储中的位置，用于生成下一页游标
+    if log_type == "system":
+        logs, total, positions = _get_store("system").query_before(None, level, position, page_size + 1)
+    elif log_type == "workflow":
+        logs, total, positions = _get_store("workflow").query_before(workflow_id, level, position, page_size + 1)
+    else:
+        # 两种日志合并后按时间排序，游标只按时间定位
+        position = position[:2] + (None,) if position else None
+        if workflow_id and workflow_id != "system":
+            system_logs, system_total = [], 0
+        else:
+            system_logs, system_total, _ = _get_store("system").query_before(None, level, position, page_size + 1)
+        workflow_logs, workflow_total, _ = _get_store("workflow").query_before(workflow_id, level, position, page_size + 1)
+        merged = heapq.merge(system_logs, workflow_logs, key=lambda x: x.get("timestamp", ""), reverse=True)
+        logs, total = list(merged)[:page_size + 1], system_total + workflow_total
+        positions = []
+    
+    # 总数始终包含归档（由清单得出，无需读取归档文件），每一页的总数一致；
+    # 热存储的日志不足一页时继续读取归档，游标指向归档中的日志时从该时间之前继续
+    if log_type in ("system", "workflow"):
+        archive = _get_archive(log_type)
+        source = workflow_id if log_type == "workflow" else None
+        archive_total = archive.count(source, level)
+        if archive_total and len(logs) <= page_size:
+            end_time = position[0] if position and not logs else None
+            for entry in archive.iter_range(source, level, None, end_time):
+                if len(logs) > page_size:
+                    break
+                logs.append(entry)
+        total += archive_total
+    
+    next_cursor = None
+    if len(logs) > page_size:
+        # 最后一条来自归档时没有存储位置，归档按时间定位
+        next_cursor = encode_log_cursor(
+            logs[page_size - 1], positions[page_size - 1] if page_size - 1 < len(positions) else None
+        )
+    return logs[:page_size], next_cursor, total
 
 def clear_logs(log_type: str = "system", workflow_id: Optional[str] = None) -> int:
     """
@@ -249,37 +893,262 @@ def clear_logs(log_type: str = "system", workflow_id: Optional[str] = None) -> i
     Returns:
         清除的日志数量
     """
+    flush_logs()
+    
     if log_type == "system":
-        logs = _load_logs("system")
-        original_count = len(logs)
-        _save_logs([], "system")
-        return original_count
-    elif log_type == "workflow":
-        if workflow_id:
-            logs = _load_logs("workflow")
-            original_count = len(logs)
-            new_logs = [log for log in logs if log.get("source") != workflow_id]
-            cleared_count = original_count - len(new_logs)
-            _save_logs(new_logs, "workflow")
-            return cleared_count
-        else:
-            logs = _load_logs("workflow")
-            original_count = len(logs)
-            _save_logs([], "workflow")
-            return original_count
+        _search_index.delete("system")
+        _log_stats.reset("system")
+        return _get_store("system").clear() + _get_archive("system").delete()
+    
+    # 工作流日志被清除后，对应的警告状态也一并清除
+    if log_type == "workflow" and workflow_id:
+        reset_workflow_warnings(workflow_id)
+        _search_index.delete("workflow", source=workflow_id)
+        _log_stats.remove_source(workflow_id)
+        return _get_store("workflow").delete(source=workflow_id) + _get_archive("workflow").delete(workflow_id)
+    for state_workflow_id in get_all_workflow_states():
+        reset_workflow_warnings(state_workflow_id)
+    _search_index.delete("workflow")
+    _log_stats.reset("workflow")
+    count = _get_store("workflow").clear() + _get_archive("workflow").delete()
+    if log_type == "workflow":
+        return count
+    # 清空所有日志
+    _search_index.delete("system")
+    _log_stats.reset("system")
+    return count + _get_store("system").clear() + _get_archive("system").delete()
+
+def compact_logs() -> Dict[str, int]:
+    """
+    按保留策略压缩日志，由调度器定期在后台执行
+    
+    超过archive_after_days天的日志先移入按天压缩的归档；之后系统日志按log_max_entries限制总条数，
+    工作流日志按每个工作流单独限制条数，日志多的工作流不会挤掉其他工作流的历史。
+    max_age_days同时适用于热存储和归档。
+    
+    Returns:
+        各类型日志删除的数量
+    """
+    flush_logs()
+    # 顺便应用修改后的重复日志抑制配置
+    _configure_log_sampler()
+    
+    config = get_config()
+    retention = {**DEFAULT_CONFIG["log_retention"], **(config.get("log_retention") or {})}
+    max_age_days = retention.get("max_age_days") or 0
+    min_timestamp = (datetime.now() - timedelta(days=max_age_days)).isoformat() if max_age_days > 0 else None
+    max_bytes = retention.get("max_bytes") or None
+    
+    # 将较早的日志移入归档，归档中的详情直接内联，不再引用数据块
+    archive_after_days = retention.get("archive_after_days") or 0
+    archived = 0
+    if archive_after_days > 0:
+        archive_before = (datetime.now() - timedelta(days=archive_after_days)).isoformat()
+        for log_type in ("system", "workflow"):
+            entries = _get_store(log_type).pop_older_than(archive_before)
+            archived += _get_archive(log_type).append([_inline_details(entry) for entry in entries])
+    if min_timestamp:
+        for log_type in ("system", "workflow"):
+            _get_archive(log_type).drop_before(min_timestamp[:10])
+    
+    removed = {
+        "system": _get_store("system").compact(
+            min_timestamp=min_timestamp,
+            max_entries=config.get("log_max_entries", 10000),
+            max_bytes=max_bytes
+        ),
+        "workflow": _get_store("workflow").compact(
+            min_timestamp=min_timestamp,
+            max_entries_per_source=retention.get("max_entries_per_workflow") or None,
+            max_bytes=max_bytes
+        ),
+    }
+    
+    # 检索索引中删除早于各来源最早一条日志（包括归档）的记录
+    _search_index.delete("system", before=_oldest_timestamp("system", None))
+    for source in _search_index.sources("workflow"):
+        _search_index.delete("workflow", source=source, before=_oldest_timestamp("workflow", source))
+    
+    # 清理不再被任何日志引用的详情数据块
+    referenced = set()
+    for log_type in ("system", "workflow"):
+        for entry in _get_store(log_type).iter_entries():
+            if entry.get("details_ref"):
+                referenced.add(entry["details_ref"])
+    _blob_store.sweep(referenced)
+    
+    if removed["system"] or removed["workflow"] or archived:
+        log_system_action(
+            "info",
+            f"日志压缩完成，归档了{archived}条日志，删除了{removed['system'] + removed['workflow']}条日志",
+            {**removed, "archived": archived}
+        )
+    return removed
+
+def _inline_details(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """将单独保存的详情放回日志中"""
+    if not entry.get("details_ref"):
+        return entry
+    details = get_log_details(entry["details_ref"])
+    entry = {k: v for k, v in entry.items() if k not in ("details_ref", "details_size")}
+    entry["details"] = details
+    return entry
+
+def _oldest_timestamp(log_type: str, source: Optional[str]) -> Optional[str]:
+    """热存储和归档中最早一条日志的时间，归档只精确到日期"""
+    candidates = [_get_store(log_type).oldest_timestamp(source), _get_archive(log_type).oldest_day(source)]
+    candidates = [c for c in candidates if c]
+    return min(candidates) if candidates else None
+
+def search_logs(
+    query: str,
+    log_type: str = "system",
+    workflow_id: Optional[str] = None,
+    log_level: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 50
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    全文检索日志消息和详情
+    
+    Args:
+        query: 检索文本，多个检索词用空格分隔
+        log_type: 日志类型，'system'、'workflow'，其他值表示不限
+        workflow_id: 工作流ID，仅当log_type为'workflow'时有效
+        log_level: 日志级别过滤
+        page: 页码，从1开始
+        page_size: 每页记录数
+        
+    Returns:
+        (命中列表, 命中总数)，按相关度排序；全部检索词都不足3个字符时无法使用索引，按时间倒序，
+        见LogSearchIndex
+    """
+    flush_logs()
+    
+    if log_type not in ("system", "workflow"):
+        log_type = None
+    return _search_index.search(
+        query,
+        log_type=log_type,
+        source=workflow_id if log_type == "workflow" else None,
+        level=_normalize_level(log_level),
+        offset=(page - 1) * page_size,
+        limit=page_size
+    )
+
+def subscribe_logs(
+    log_type: Optional[str] = None,
+    workflow_id: Optional[str] = None,
+    log_level: Optional[str] = None,
+    run_id: Optional[str] = None
+) -> LogSubscription:
+    """
+    订阅新日志，需在事件循环中调用，使用完毕后调用unsubscribe_logs
+    
+    Args:
+        log_type: 日志类型，'system' 或 'workflow'，其他值表示不限
+        workflow_id: 工作流ID，仅当log_type为'workflow'时有效
+        log_level: 日志级别过滤
+        run_id: 运行ID过滤
+        
+    Returns:
+        订阅对象，通过其get方法等待新日志
+    """
+    if log_type not in ("system", "workflow"):
+        log_type = None
+    return _broadcaster.subscribe(
+        log_type=log_type,
+        source=workflow_id if log_type == "workflow" and workflow_id else None,
+        level=_normalize_level(log_level),
+        run_id=run_id or None
+    )
+
+def unsubscribe_logs(subscription: LogSubscription):
+    """取消日志订阅"""
+    _broadcaster.unsubscribe(subscription)
+
+def iter_logs(
+    log_type: str = "system",
+    workflow_id: Optional[str] = None,
+    log_level: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None
+):
+    """
+    按时间倒序逐条遍历匹配的日志（包括归档），用于导出
+    
+    日志分批从存储中读取，不会一次加载全部日志；单独保存的详情会放回日志中。
+    
+    Args:
+        log_type: 日志类型，'system'、'workflow' 或 'all'
+        workflow_id: 工作流ID，仅当log_type为'workflow'或'all'时有效
+        log_level: 日志级别过滤
+        start_time: 起始时间（含，ISO格式）
+        end_time: 结束时间（不含，ISO格式）
+    """
+    flush_logs()
+    level = _normalize_level(log_level)
+    
+    if log_type in ("system", "workflow"):
+        source = workflow_id if log_type == "workflow" else None
+        entries = _iter_logs_in_range(log_type, source, level, start_time, end_time)
     else:
-        # 清空所有日志
-        system_count = len(_load_logs("system"))
-        workflow_count = len(_load_logs("workflow"))
-        _save_logs([], "system")
-        _save_logs([], "workflow")
-        return system_count + workflow_count
-
-def log_system_action(level: str, message: str, details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        sources = [] if workflow_id and workflow_id != "system" else \
+            [_iter_logs_in_range("system", None, level, start_time, end_time)]
+        if workflow_id != "system":
+            sources.append(_iter_logs_in_range("workflow", workflow_id, level, start_time, end_time))
+        entries = heapq.merge(*sources, key=lambda x: x.get("timestamp", ""), reverse=True)
+    
+    for entry in entries:
+        yield _inline_details(entry)
+
+def get_log_stats(workflow_id: Optional[str] = None, days: int = 7) -> Dict[str, Any]:
+    """
+    获取日志统计，统计随日志写入增量维护，无需读取日志
+    
+    Args:
+        workflow_id: 工作流ID，指定时只统计该工作流
+        days: 按天统计的天数
+        
+    Returns:
+        各级别的日志数量：总计、最近24小时、最近days天及每天的明细，未指定工作流时还包含各工作流的统计
+    """
+    flush_logs()
+    return _log_stats.summary(workflow_id, days)
+
+def get_run_logs(run_id: str) -> List[Dict[str, Any]]:
+    """
+    获取一次工作流运行的全部日志，通过运行ID索引直接读取
+    
+    Args:
+        run_id: 运行ID
+        
+    Returns:
+        该次运行的日志，按时间顺序排列
+    """
+    flush_logs()
+    return _get_store("workflow").query_run(run_id)
+
+def get_log_details(details_ref: str) -> Optional[Any]:
+    """
+    读取单独保存的日志详情
+    
+    Args:
+        details_ref: 日志中的details_ref字段
+        
+    Returns:
+        日志详情，不存在时返回None
+    """
+    data = _blob_store.get(details_ref)
+    return json.loads(data) if data is not None else None
+
+def log_system_action(level: str, message: Union[str, Callable[[], str]],
+                      details: Union[Dict[str, Any], Callable[[], Optional[Dict[str, Any]]], None] = None) -> Optional[Dict[str, Any]]:
     """记录系统操作日志"""
     return add_log(level, "system", message, details)
 
-def log_workflow_action(workflow_id: str, level: str, message: str, details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def log_workflow_action(workflow_id: str, level: str, message: Union[str, Callable[[], str]],
+                        details: Union[Dict[str, Any], Callable[[], Optional[Dict[str, Any]]], None] = None) -> Optional[Dict[str, Any]]:
     """记录工作流操作日志"""
     return add_log(level, workflow_id, message, details)
 
@@ -295,68 +1164,91 @@ def get_workflow_logs(workflow_id: Optional[str] = None, limit: int = 100, offse
     return logs
 
 # 迁移旧日志到新系统
+def get_log_schema_version() -> int:
+    """读取日志存储版本标记，没有标记时返回0"""
+    try:
+        with open(LOG_SCHEMA_FILE, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("version", 0))
+    except (FileNotFoundError, json.JSONDecodeError, ValueError, TypeError, AttributeError):
+        return 0
+
+def _set_log_schema_version(version: int):
+    """原子写入日志存储版本标记"""
+    os.makedirs(LOG_DIR_PATH, exist_ok=True)
+    tmp_path = LOG_SCHEMA_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "migrated_at": datetime.now().isoformat()}, f)
+    os.replace(tmp_path, LOG_SCHEMA_FILE)
+
 def migrate_old_logs():
-    """将旧的日志格式迁移到新的分离格式"""
-    old_log_file = os.path.join(get_data_dir(), "logs.json")
-    if os.path.exists(old_log_file):
-        try:
-            with open(old_log_file, "r", encoding="utf-8") as f:
-                old_logs = json.load(f)
-            
-            system_logs = [log for log in old_logs if log.get("source") == "system"]
-            workflow_logs = [log for log in old_logs if log.get("source") != "system"]
-            
-            # 如果新文件不存在，先创建
-            _ensure_logs_file(SYSTEM_LOG_FILE_PATH)
-            _ensure_logs_file(WORKFLOW_LOG_FILE_PATH)
-            
-            # 加载现有的新日志
-            existing_system_logs = _load_logs("system")
-            existing_workflow_logs = _load_logs("workflow")
-            
-            # 合并日志
-            merged_system_logs = existing_system_logs + system_logs
-            merged_workflow_logs = existing_workflow_logs + workflow_logs
-            
-            # 按时间排序
-            merged_system_logs.sort(key=lambda x: x.get("timestamp", ""))
-            merged_workflow_logs.sort(key=lambda x: x.get("timestamp", ""))
-            
-            # 保存合并后的日志
-            _save_logs(merged_system_logs, "system")
-            _save_logs(merged_workflow_logs, "workflow")
-            
-            # 重命名旧日志文件作为备份
-            os.rename(old_log_file, old_log_file + ".bak")
-            
-            logging.info("成功迁移旧日志到新的分离存储格式")
-        except Exception as e:
-            logging.error(f"迁移旧日志失败: {str(e)}")
+    """
+    将旧的日志格式迁移到新的分离格式
+    
+    迁移成功后写入版本标记，之后的启动直接跳过。旧日志文件流式读取，与已有日志按时间归并后写入，
+    内存占用与日志总量无关。整个迁移持有专用的文件锁，多个进程同时启动时只有一个进程迁移。
+    """
+    if get_log_schema_version() >= LOG_SCHEMA_VERSION:
+        return
+    
+    with FileLock(LOG_SCHEMA_FILE + ".lock"):
+        # 等待锁期间其他进程可能已完成迁移
+        if get_log_schema_version() >= LOG_SCHEMA_VERSION:
+            return
+        
+        old_log_file = os.path.join(get_data_dir(), "logs.json")
+        if os.path.exists(old_log_file):
+            try:
+                flush_logs()
+                
+                for log_type in ("system", "workflow"):
+                    _merge_into_store(log_type, _iter_legacy_logs(old_log_file, log_type))
+                    # 日志写入存储后再更新检索索引、统计和警告状态，迁移失败时不会指向不存在的日志
+                    for batch in iter_batches(_iter_legacy_logs(old_log_file, log_type)):
+                        _after_write(log_type, batch)
+                
+                # 重命名旧日志文件作为备份
+                os.rename(old_log_file, old_log_file + ".bak")
+                
+                logging.info("成功迁移旧日志到新的分离存储格式")
+            except Exception as e:
+                logging.error(f"迁移旧日志失败: {str(e)}")
+                return
+        
+        _set_log_schema_version(LOG_SCHEMA_VERSION)
+
+def _iter_legacy_logs(old_log_file: str, log_type: str):
+    """旧日志按时间顺序追加写入，每种类型各读取一遍"""
+    return (
+        log for log in iter_json_array(old_log_file)
+        if isinstance(log, dict) and (log.get("source") == "system") == (log_type == "system")
+    )
+
+def _merge_into_store(log_type: str, entries):
+    """
+    将按时间排序的日志与存储中的已有日志归并
+    
+    SQLite后端查询时按时间排序，直接追加；分段存储按写入顺序保存，在存储的锁内
+    将两者按时间归并后替换原目录，归并期间的新日志等待归并完成后写入。
+    迁移的日志与新写入的日志一样拆分大详情。
+    """
+    store = _get_store(log_type)
+    entries = (_offload_details(entry) for entry in entries)
+    if isinstance(store, SQLiteLogStore):
+        for batch in iter_batches(entries):
+            store.append_many(batch)
+        return
+    
+    store.merge_sorted(entries)
 
 def clear_workflow_warnings(workflow_id: str) -> int:
-    """清除工作流的所有警告日志，用于重试成功后清除警告状态
+    """清除工作流的警告状态，用于重试成功后清除警告状态
+    
+    只推进工作流的警告确认水位线，不改写日志，警告日志仍保留在历史记录中。
     
     Args:
         workflow_id: 工作流ID
         
     Returns:
-        int: 清除的日志数量
+        int: 被确认的警告数量
     """
-    init_logs()
-    logs = _load_logs("workflow")
-    
-    # 过滤出需要保留的日志（非该工作流的WARNING日志）
-    filtered_logs = [
-        log for log in logs 
-        if not (log.get("source") == workflow_id and 
-                log.get("level") == "warning")
-    ]
-    
-    # 计算移除的日志数量
-    removed_count = len(logs) - len(filtered_logs)
-    
-    # 只有在有日志被移除时才写入文件
-    if removed_count > 0:
-        _save_logs(filtered_logs, "workflow")
-    
-    return removed_count 
\ No newline at end of file
+    return reset_workflow_warnings(workflow_id)
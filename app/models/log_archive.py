@@ -0,0 +1,267 @@
+import os
+import json
+import gzip
+import threading
+from typing import Dict, List, Any, Optional, Iterator
+
+from app.utils.file_lock import FileLock
+
+# 归档文件扩展名，每天一个文件
+ARCHIVE_SUFFIX = ".ndjson.gz"
+
+# 归档清单文件名
+MANIFEST_FILE = "manifest.json"
+
+
+class LogArchive:
+    """
+    按天归档的压缩冷日志
+
+    超过一定时间的日志从热存储移入归档，每天一个gzip压缩的NDJSON文件。
+    清单中记录每天按来源和级别统计的日志数量，统计总数和按页跳过整天的日志都无需读取归档文件。
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: 归档目录
+        """
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._manifest: Optional[Dict[str, Dict[str, Dict[str, int]]]] = None
+        self._manifest_mtime: Optional[int] = None
+        # 多个进程共用归档时，修改归档和清单前持有文件锁
+        self._file_lock = FileLock(os.path.join(directory, ".lock"))
+
+    def _day_path(self, day: str) -> str:
+        return os.path.join(self.directory, day + ARCHIVE_SUFFIX)
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """清单格式：{日期: {来源: {级别: 数量}}}，清单文件被其他进程修改后重新读取"""
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._manifest is None or mtime != self._manifest_mtime:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._manifest = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._manifest = {}
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def _save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, path)
+        self._manifest_mtime = os.stat(path).st_mtime_ns
+
+    @staticmethod
+    def _day_count(sources: Dict[str, Dict[str, int]], source: Optional[str], level: Optional[str]) -> int:
+        """某一天中匹配来源/级别的日志数量"""
+        selected = [sources.get(source, {})] if source is not None else sources.values()
+        return sum(levels.get(level, 0) if level is not None else sum(levels.values()) for levels in selected)
+
+    @staticmethod
+    def _encode(entries: List[Dict[str, Any]]) -> bytes:
+        return b"".join(
+            (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            for entry in entries
+        )
+
+    def _read_day(self, day: str) -> List[Dict[str, Any]]:
+        """读取一天的归档，按写入顺序返回"""
+        entries = []
+        try:
+            with gzip.open(self._day_path(day), "rb") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except (FileNotFoundError, EOFError, OSError):
+            pass
+        return entries
+
+    # ---- 写入 ----
+
+    def append(self, entries: List[Dict[str, Any]]) -> int:
+        """
+        将日志追加到对应日期的归档文件
+
+        gzip文件支持直接追加新的压缩段，读取时按顺序解压全部段。
+
+        Returns:
+            归档的日志数量
+        """
+        if not entries:
+            return 0
+        by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in entries:
+            by_day.setdefault(entry.get("timestamp", "")[:10] or "unknown", []).append(entry)
+        with self._lock, self._file_lock:
+            # 持有文件锁后重新读取清单，包含其他进程的修改
+            self._manifest = None
+            manifest = self._load_manifest()
+            for day, day_entries in by_day.items():
+                with gzip.open(self._day_path(day), "ab") as f:
+                    f.write(self._encode(day_entries))
+                sources = manifest.setdefault(day, {})
+                for entry in day_entries:
+                    levels = sources.setdefault(str(entry.get("source", "")), {})
+                    level = entry.get("level") or "info"
+                    levels[level] = levels.get(level, 0) + 1
+            self._save_manifest()
+        return len(entries)
+
+    # ---- 读取 ----
+
+    def days(self) -> List[str]:
+        """已归档的日期，从早到晚"""
+        with self._lock:
+            return sorted(self._load_manifest())
+
+    def count(self, source: Optional[str] = None, level: Optional[str] = None) -> int:
+        """归档中匹配来源/级别的日志数量，直接由清单得出"""
+        with self._lock:
+            return sum(self._day_count(sources, source, level) for sources in self._load_manifest().values())
+
+    def oldest_day(self, source: Optional[str] = None) -> Optional[str]:
+        """指定来源最早归档的日期，没有归档时返回None"""
+        with self._lock:
+            days = [day for day, sources in self._load_manifest().items() if self._day_count(sources, source, None)]
+            return min(days) if days else None
+
+    def query(self, source: Optional[str] = None, level: Optional[str] = None,
+              offset: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        按来源和级别查询归档日志，最新的在前
+
+        按清单中的数量跳过整天的日志，只解压包含当前页的归档文件。
+        """
+        results: List[Dict[str, Any]] = []
+        with self._lock:
+            manifest = self._load_manifest()
+            for day in sorted(manifest, reverse=True):
+                if len(results) >= limit:
+                    break
+                day_count = self._day_count(manifest[day], source, level)
+                if offset >= day_count:
+                    offset -= day_count
+                    continue
+                matched = [entry for entry in reversed(self._read_day(day)) if self._matches(entry, source, level)]
+                results.extend(matched[offset:offset + limit - len(results)])
+                offset = 0
+        return results
+
+    def iter_range(self, source: Optional[str] = None, level: Optional[str] = None,
+                   start_time: Optional[str] = None, end_time: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        按时间范围倒序遍历归档日志，只读取范围内且有匹配日志的日期
+
+        Args:
+            start_time: 起始时间（含），None表示不限
+            end_time: 结束时间（不含），None表示不限
+        """
+        with self._lock:
+            manifest = self._load_manifest()
+            days = [
+                day for day in sorted(manifest, reverse=True)
+                if (start_time is None or day >= start_time[:10])
+                and (end_time is None or day <= end_time[:10])
+                and self._day_count(manifest[day], source, level)
+            ]
+        for day in days:
+            for entry in reversed(self._read_day(day)):
+                timestamp = entry.get("timestamp", "")
+                if start_time is not None and timestamp < start_time:
+                    continue
+                if end_time is not None and timestamp >= end_time:
+                    continue
+                if self._matches(entry, source, level):
+                    yield entry
+
+    @staticmethod
+    def _matches(entry: Dict[str, Any], source: Optional[str], level: Optional[str]) -> bool:
+        return (source is None or str(entry.get("source", "")) == source) and \
+               (level is None or (entry.get("level") or "info") == level)
+
+    # ---- 删除 ----
+
+    def drop_before(self, day: str) -> int:
+        """
+        删除早于指定日期的归档
+
+        Returns:
+            删除的日志数量
+        """
+        removed = 0
+        with self._lock, self._file_lock:
+            # 持有文件锁后重新读取清单，包含其他进程的修改
+            self._manifest = None
+            manifest = self._load_manifest()
+            for archived_day in [d for d in manifest if d < day]:
+                removed += self._day_count(manifest.pop(archived_day), None, None)
+                try:
+                    os.remove(self._day_path(archived_day))
+                except FileNotFoundError:
+                    pass
+            if removed:
+                self._save_manifest()
+        return removed
+
+    def delete(self, source: Optional[str] = None) -> int:
+        """
+        删除指定来源的归档日志，None表示全部删除
+
+        Returns:
+            删除的日志数量
+        """
+        removed = 0
+        with self._lock, self._file_lock:
+            # 持有文件锁后重新读取清单，包含其他进程的修改
+            self._manifest = None
+            manifest = self._load_manifest()
+            for day in list(manifest):
+                sources = manifest[day]
+                if source is not None and source not in sources:
+                    continue
+                count = self._day_count(sources, source, None)
+                remaining = [] if source is None else \
+                    [entry for entry in self._read_day(day) if str(entry.get("source", "")) != source]
+                if remaining:
+                    tmp_path = self._day_path(day) + ".tmp"
+                    with gzip.open(tmp_path, "wb") as f:
+                        f.write(self._encode(remaining))
+                    os.replace(tmp_path, self._day_path(day))
+                    sources.pop(source)
+                else:
+                    try:
+                        os.remove(self._day_path(day))
+                    except FileNotFoundError:
+                        pass
+                    manifest.pop(day)
+                removed += count
+            if removed:
+                self._save_manifest()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """归档的天数、日志数量和压缩后的大小"""
+        with self._lock:
+            manifest = self._load_manifest()
+            size = sum(
+                os.path.getsize(self._day_path(day)) for day in manifest if os.path.exists(self._day_path(day))
+            )
+            return {
+                "days": len(manifest),
+                "count": self.count(),
+                "bytes": size,
+                "first_day": min(manifest) if manifest else None,
+                "last_day": max(manifest) if manifest else None,
+            }
@@ -0,0 +1,106 @@
+import os
+import re
+import time
+import zlib
+import hashlib
+import threading
+from typing import Optional, Set
+
+# 内容ID为内容的SHA-256十六进制摘要
+_BLOB_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+class LogBlobStore:
+    """
+    日志大字段的压缩内容寻址存储
+
+    每个数据块按内容的SHA-256命名，zlib压缩后保存为单独的文件，内容相同的数据块只保存一份。
+    日志中只保留数据块ID，列表查询无需读取和解析这些数据。
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: 数据块所在目录
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, blob_id: str) -> str:
+        # 按ID前两位分目录，避免单个目录文件过多
+        return os.path.join(self.directory, blob_id[:2], blob_id + ".z")
+
+    def put(self, data: bytes) -> str:
+        """
+        保存数据块
+
+        Args:
+            data: 原始数据
+
+        Returns:
+            数据块ID
+        """
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self._path(blob_id)
+        with self._lock:
+            if os.path.exists(path):
+                # 已存在的数据块被再次引用，更新修改时间以免被清理
+                os.utime(path)
+                return blob_id
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 多个进程可能同时写入同一个数据块，临时文件名按进程区分
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp_path, path)
+        return blob_id
+
+    def get(self, blob_id: str) -> Optional[bytes]:
+        """
+        读取数据块
+
+        Returns:
+            原始数据，ID无效或数据块不存在时返回None
+        """
+        if not _BLOB_ID.match(blob_id or ""):
+            return None
+        try:
+            with open(self._path(blob_id), "rb") as f:
+                return zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error):
+            return None
+
+    def sweep(self, referenced: Set[str], min_age: float = 600) -> int:
+        """
+        删除不再被任何日志引用的数据块
+
+        Args:
+            referenced: 仍被引用的数据块ID
+            min_age: 只删除修改时间早于该秒数的数据块，避免删除刚写入、日志尚未落盘的数据块
+
+        Returns:
+            删除的数据块数量
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        cutoff = time.time() - min_age
+        with self._lock:
+            for prefix in os.listdir(self.directory):
+                prefix_dir = os.path.join(self.directory, prefix)
+                if not os.path.isdir(prefix_dir):
+                    continue
+                for name in os.listdir(prefix_dir):
+                    blob_id = name[:-2] if name.endswith(".z") else None
+                    if blob_id is None or blob_id in referenced:
+                        continue
+                    path = os.path.join(prefix_dir, name)
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            removed += 1
+                    except FileNotFoundError:
+                        continue
+                if not os.listdir(prefix_dir):
+                    os.rmdir(prefix_dir)
+        return removed
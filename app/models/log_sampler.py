@@ -0,0 +1,152 @@
+import re
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+# 同时跟踪的消息模板数量上限，超过后新的模板不再抑制
+MAX_TRACKED_KEYS = 10000
+
+# 消息中的数字（次数、耗时、序号等）不区分模板
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+# 每条汇总日志最多记录的运行ID数量
+MAX_ROLLUP_RUN_IDS = 100
+
+# 从不抑制的日志级别
+_NEVER_SUPPRESS = ("warning", "error")
+
+
+class _Window:
+    """一个(来源, 消息模板)在当前时间窗口内的计数"""
+
+    __slots__ = ("started", "passed", "over", "suppressed", "level", "message", "run_id", "run_ids", "first_at", "last_at")
+
+    def __init__(self, started: float):
+        self.started = started
+        self.passed = 0
+        self.over = 0
+        self.suppressed = 0
+        self.level = "info"
+        self.message = ""
+        self.run_id: Optional[str] = None
+        self.run_ids: List[str] = []
+        self.first_at: Optional[str] = None
+        self.last_at: Optional[str] = None
+
+
+class LogSampler:
+    """
+    重复日志抑制与采样
+
+    按(来源, 消息模板)计数，每个时间窗口内只记录前burst条相同的日志，之后的日志只计数，
+    其中每sample_every条仍记录一条作为采样。窗口结束后用一条汇总日志记录被省略的数量，
+    日志量与不同事件的数量相关，而不是与重复次数相关。警告和错误日志从不抑制。
+    计数不区分运行，频繁执行的定时任务每次运行的重复日志同样会被抑制；汇总日志属于最后一条
+    被省略日志所在的运行，详情中的run_ids列出被省略日志涉及的所有运行。
+    """
+
+    def __init__(self, window_seconds: float = 60, burst: int = 10, sample_every: int = 100, enabled: bool = True):
+        """
+        Args:
+            window_seconds: 时间窗口长度（秒）
+            burst: 每个窗口内完整记录的条数
+            sample_every: 超出burst后每隔多少条记录一条，0表示不采样
+            enabled: 是否启用
+        """
+        self._lock = threading.Lock()
+        self._windows: Dict[Tuple[str, str], _Window] = {}
+        self.configure(window_seconds, burst, sample_every, enabled)
+
+    def configure(self, window_seconds: float = 60, burst: int = 10, sample_every: int = 100, enabled: bool = True):
+        """更新抑制参数，已有窗口按新参数继续计数"""
+        self.window_seconds = max(float(window_seconds), 1.0)
+        self.burst = max(int(burst), 1)
+        self.sample_every = max(int(sample_every), 0)
+        self.enabled = bool(enabled)
+
+    @staticmethod
+    def template(message: str) -> str:
+        """消息模板：将数字替换为占位符"""
+        return _NUMBER.sub("#", message)
+
+    def allow(self, level: str, source: str, message: str, run_id: Optional[str] = None) -> bool:
+        """
+        判断一条日志是否需要记录，不需要时计入被省略的数量
+
+        Returns:
+            True表示记录该日志
+        """
+        if not self.enabled or level in _NEVER_SUPPRESS:
+            return True
+        key = (source, self.template(message))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                if len(self._windows) >= MAX_TRACKED_KEYS:
+                    return True
+                window = self._windows[key] = _Window(now)
+            if window.passed < self.burst:
+                window.passed += 1
+                return True
+            window.over += 1
+            if self.sample_every and window.over % self.sample_every == 0:
+                # 采样记录的日志不计入省略数量
+                return True
+            window.suppressed += 1
+            timestamp = datetime.now().isoformat()
+            window.level = level
+            window.message = message
+            window.run_id = run_id
+            if run_id and run_id not in window.run_ids and len(window.run_ids) < MAX_ROLLUP_RUN_IDS:
+                window.run_ids.append(run_id)
+            window.first_at = window.first_at or timestamp
+            window.last_at = timestamp
+            return False
+
+    def drain(self, force: bool = False) -> List[Dict[str, Any]]:
+        """
+        取出需要输出的汇总，并移除已结束的窗口
+
+        Args:
+            force: 为True时未结束的窗口也输出已省略的数量，窗口本身继续计数
+
+        Returns:
+            汇总列表，每项包含level、source、message、details和run_id
+        """
+        now = time.monotonic()
+        rollups = []
+        with self._lock:
+            for key, window in list(self._windows.items()):
+                expired = now - window.started >= self.window_seconds
+                if window.suppressed and (expired or force):
+                    rollups.append({
+                        "level": window.level,
+                        "source": key[0],
+                        "message": f"{window.message}（重复{window.suppressed}次，已省略）",
+                        "details": {
+                            "repeated": window.suppressed,
+                            "template": key[1],
+                            "first_at": window.first_at,
+                            "last_at": window.last_at,
+                            "run_ids": window.run_ids,
+                        },
+                        "run_id": window.run_id,
+                    })
+                    window.suppressed = 0
+                    window.run_id = None
+                    window.run_ids = []
+                    window.first_at = window.last_at = None
+                if expired:
+                    del self._windows[key]
+        return rollups
+
+    def stats(self) -> Dict[str, Any]:
+        """当前跟踪的模板数量和等待汇总的省略数量"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "tracked": len(self._windows),
+                "suppressed_pending": sum(w.suppressed for w in self._windows.values()),
+            }
@@ -0,0 +1,237 @@
+import os
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+# 从日志详情中提取用于检索的文本的最大长度
+DETAILS_TEXT_MAX_CHARS = 4096
+
+# trigram分词要求检索词至少3个字符，更短的检索词（如两个字的中文词）无法使用索引，改用LIKE匹配
+_TRIGRAM_MIN_CHARS = 3
+
+logger = logging.getLogger("log_search")
+
+
+class LogSearchIndex:
+    """
+    日志全文检索索引
+
+    使用SQLite FTS5虚拟表索引日志消息和详情中的文本，SQLite支持时使用trigram分词，
+    可以检索中文和URL等任意子串，结果按bm25相关度排序。
+    trigram索引只能匹配至少3个字符的检索词：与较长的检索词一起使用时，短检索词在索引命中的结果中
+    用LIKE过滤；全部检索词都不足3个字符时只能逐行LIKE扫描，结果按时间倒序而不是相关度，
+    日志量大时较慢。
+    索引独立于日志存储，两种日志后端共用。
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: 索引数据库文件路径
+        """
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._trigram = False
+        self.available = True
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None and self.available:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            # 多个进程同时写入时等待其他进程的写事务完成
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            columns = "message, details, id UNINDEXED, log_type UNINDEXED, source UNINDEXED, " \
+                      "level UNINDEXED, timestamp UNINDEXED, run_id UNINDEXED"
+            try:
+                # 多个进程可能同时创建索引表，IF NOT EXISTS使后创建的进程直接使用已有的表
+                try:
+                    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5({columns}, tokenize='trigram')")
+                except sqlite3.OperationalError:
+                    # SQLite版本低于3.34，不支持trigram分词
+                    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5({columns})")
+                existing = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'log_fts'").fetchone()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"SQLite不支持FTS5，日志全文检索不可用: {str(e)}")
+                conn.close()
+                self.available = False
+                return None
+            self._trigram = "trigram" in existing[0]
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _details_text(details: Any) -> str:
+        """提取日志详情中的字符串和数值，用于检索"""
+        parts: List[str] = []
+        size = 0
+        stack = [details]
+        while stack and size < DETAILS_TEXT_MAX_CHARS:
+            value = stack.pop()
+            if isinstance(value, dict):
+                stack.extend(reversed(list(value.values())))
+            elif isinstance(value, (list, tuple)):
+                stack.extend(reversed(value))
+            elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                text = str(value)
+                parts.append(text)
+                size += len(text) + 1
+        return " ".join(parts)[:DETAILS_TEXT_MAX_CHARS]
+
+    # ---- 写入 ----
+
+    def add(self, log_type: str, entries: List[Dict[str, Any]]):
+        """将一批日志加入索引"""
+        if not entries:
+            return
+        rows = [
+            (
+                entry.get("message") or "",
+                self._details_text(entry.get("details")) if entry.get("details") else "",
+                entry.get("id"),
+                log_type,
+                str(entry.get("source", "")),
+                entry.get("level") or "info",
+                entry.get("timestamp", ""),
+                entry.get("run_id"),
+            )
+            for entry in entries
+        ]
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            with conn:
+                conn.executemany(
+                    "INSERT INTO log_fts (message, details, id, log_type, source, level, timestamp, run_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def delete(self, log_type: str, source: Optional[str] = None, before: Optional[str] = None) -> int:
+        """
+        从索引中删除日志
+
+        Args:
+            log_type: 日志类型
+            source: 日志来源，None表示不限
+            before: 只删除时间早于该值的日志，None表示全部删除
+
+        Returns:
+            删除的记录数量
+        """
+        clauses, params = ["log_type = ?"], [log_type]
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if before is not None:
+            clauses.append("timestamp < ?")
+            params.append(before)
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return 0
+            with conn:
+                return conn.execute(f"DELETE FROM log_fts WHERE {' AND '.join(clauses)}", params).rowcount
+
+    def sources(self, log_type: str) -> List[str]:
+        """索引中出现过的日志来源"""
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return []
+            return [row[0] for row in conn.execute("SELECT DISTINCT source FROM log_fts WHERE log_type = ?", (log_type,))]
+
+    # ---- 检索 ----
+
+    def search(self, query: str, log_type: Optional[str] = None, source: Optional[str] = None,
+               level: Optional[str] = None, offset: int = 0, limit: int = 50) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        检索日志，多个检索词之间为“与”关系
+
+        Args:
+            query: 检索文本，按空白分隔为多个检索词
+            log_type: 日志类型，None表示不限
+            source: 日志来源，None表示不限
+            level: 日志级别，None表示不限
+            offset: 跳过的条数
+            limit: 返回的最大条数
+
+        Returns:
+            (命中列表, 命中总数)，命中按相关度排序，包含日志的基本字段、匹配片段和得分；
+            全部检索词都不足3个字符时按时间倒序，没有匹配片段和得分
+        """
+        terms = [term for term in query.split() if term]
+        if not terms:
+            return [], 0
+        with self._lock:
+            # 连接时才能确定是否使用了trigram分词
+            if self._connect() is None:
+                return [], 0
+
+        clauses, params = [], []
+        if log_type is not None:
+            clauses.append("log_type = ?")
+            params.append(log_type)
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if level is not None:
+            clauses.append("level = ?")
+            params.append(level)
+
+        # trigram分词时，短检索词不能用于MATCH，只作为LIKE条件过滤
+        match_terms = [term for term in terms if not self._trigram or len(term) >= _TRIGRAM_MIN_CHARS]
+        like_terms = [term for term in terms if term not in match_terms]
+        use_match = bool(match_terms)
+        if use_match:
+            # 每个检索词作为短语匹配，避免FTS查询语法干扰
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in match_terms)
+            clauses.insert(0, "log_fts MATCH ?")
+            params.insert(0, match)
+            order = "rank"
+        else:
+            order = "timestamp DESC"
+        for term in like_terms:
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("(message LIKE ? ESCAPE '\\' OR details LIKE ? ESCAPE '\\')")
+            params.extend([f"%{escaped}%", f"%{escaped}%"])
+        where = " AND ".join(clauses)
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                total = conn.execute(f"SELECT COUNT(*) FROM log_fts WHERE {where}", params).fetchone()[0]
+                extra = "snippet(log_fts, -1, '[', ']', '...', 64), rank" if use_match else "message, 0"
+                rows = conn.execute(
+                    f"SELECT id, log_type, source, level, timestamp, run_id, message, {extra} "
+                    f"FROM log_fts WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                    params + [limit, offset]
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"日志检索失败: {str(e)}")
+                return [], 0
+
+        hits = []
+        for log_id, hit_type, hit_source, hit_level, timestamp, run_id, message, snippet, rank in rows:
+            hits.append({
+                "id": log_id,
+                "log_type": hit_type,
+                "source": hit_source,
+                "level": hit_level,
+                "timestamp": timestamp,
+                "run_id": run_id,
+                "message": message,
+                "snippet": snippet,
+                "score": -rank if use_match else None,
+            })
+        return hits, total
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
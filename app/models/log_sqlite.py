@@ -0,0 +1,324 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+# 日志表中单独成列的字段，其余字段存入extra列
+_COLUMNS = ["id", "timestamp", "level", "source", "message", "details", "run_id"]
+_ROW_COLUMNS = ", ".join(_COLUMNS + ["extra"])
+
+# 一行日志数据的字节数
+_ROW_BYTES = " + ".join(f"COALESCE(LENGTH(CAST({c} AS BLOB)), 0)" for c in _COLUMNS + ["extra"])
+
+
+class SQLiteLogStore:
+    """
+    基于SQLite的日志存储
+
+    与SegmentLogStore提供相同的接口。使用WAL模式，并在 (source, level, timestamp)
+    等组合上建立索引，过滤、分页和删除都是索引查询。
+    """
+
+    def __init__(self, db_path: str, table: str):
+        """
+        Args:
+            db_path: 数据库文件路径
+            table: 日志表名
+        """
+        self.db_path = db_path
+        self.table = table
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            # 多个进程同时写入时等待其他进程的写事务完成
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            t = self.table
+            conn.executescript(f"""
+                CREATE TABLE IF NOT EXISTS {t} (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                    timestamp TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    message TEXT,
+                    details TEXT,
+                    extra TEXT,
+                    run_id TEXT
+                );
+            """)
+            # 早期创建的日志表没有run_id列
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({t})")]
+            if "run_id" not in columns:
+                conn.execute(f"ALTER TABLE {t} ADD COLUMN run_id TEXT")
+            conn.executescript(f"""
+                CREATE INDEX IF NOT EXISTS idx_{t}_source_level_ts ON {t} (source, level, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_{t}_source_ts ON {t} (source, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_{t}_level_ts ON {t} (level, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_{t}_ts ON {t} (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_{t}_run ON {t} (run_id) WHERE run_id IS NOT NULL;
+            """)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _to_row(entry: Dict[str, Any]) -> Tuple:
+        extra = {k: v for k, v in entry.items() if k not in _COLUMNS}
+        details = entry.get("details")
+        return (
+            entry.get("id"),
+            entry.get("timestamp", ""),
+            entry.get("level") or "info",
+            str(entry.get("source", "")),
+            entry.get("message"),
+            json.dumps(details, ensure_ascii=False) if details is not None else None,
+            entry.get("run_id"),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    @staticmethod
+    def _from_row(row: Tuple) -> Dict[str, Any]:
+        entry = dict(zip(_COLUMNS, row[:len(_COLUMNS)]))
+        entry["details"] = json.loads(entry["details"]) if entry["details"] else None
+        if row[len(_COLUMNS)]:
+            entry.update(json.loads(row[len(_COLUMNS)]))
+        return entry
+
+    @staticmethod
+    def _where(source: Optional[str], level: Optional[str]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if level is not None:
+            clauses.append("level = ?")
+            params.append(level)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # ---- 写入 ----
+
+    def append(self, entry: Dict[str, Any]):
+        """追加一条日志"""
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> bool:
+        """
+        批量追加日志，ID重复的日志会被忽略
+
+        Returns:
+            SQLite没有分段，始终返回False
+        """
+        if not entries:
+            return False
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {self.table} "
+                    f"({_ROW_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [self._to_row(entry) for entry in entries]
+                )
+        return False
+
+    # ---- 读取 ----
+
+    def is_empty(self) -> bool:
+        """日志表是否为空"""
+        with self._lock:
+            return self._connect().execute(f"SELECT 1 FROM {self.table} LIMIT 1").fetchone() is None
+
+    def count(self, source: Optional[str] = None, level: Optional[str] = None) -> int:
+        """日志数量"""
+        where, params = self._where(source, level)
+        with self._lock:
+            return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}{where}", params).fetchone()[0]
+
+    def query(self, source: Optional[str] = None, level: Optional[str] = None,
+              offset: int = 0, limit: int = 50) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        按来源和级别查询日志，结果按时间倒序（最新的在前）
+
+        Returns:
+            (日志列表, 总数)
+        """
+        where, params = self._where(source, level)
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute(f"SELECT COUNT(*) FROM {self.table}{where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {_ROW_COLUMNS} FROM {self.table}{where} "
+                f"ORDER BY timestamp DESC, seq DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [self._from_row(row) for row in rows], total
+
+    def query_before(self, source: Optional[str] = None, level: Optional[str] = None,
+                     cursor: Optional[Tuple[str, str, Any]] = None,
+                     limit: int = 50) -> Tuple[List[Dict[str, Any]], int, List[Any]]:
+        """
+        键集分页查询，返回排在游标之后（更早）的日志，结果按时间倒序
+
+        通过 (timestamp, seq) 上的索引直接定位，不使用OFFSET。
+
+        Args:
+            cursor: 上一页最后一条日志的 (时间, ID, 位置)，None表示从最新的日志开始；
+                结果按时间排序，按ID查出seq即可定位，不使用位置
+
+        Returns:
+            (日志列表, 总数, 每条日志的seq)
+        """
+        where, params = self._where(source, level)
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute(f"SELECT COUNT(*) FROM {self.table}{where}", params).fetchone()[0]
+            cond = where
+            if cursor:
+                timestamp, log_id = cursor[0], cursor[1]
+                row = conn.execute(f"SELECT seq FROM {self.table} WHERE id = ?", (log_id,)).fetchone()
+                cond += " AND " if where else " WHERE "
+                if row:
+                    cond += "(timestamp < ? OR (timestamp = ? AND seq < ?))"
+                    params = params + [timestamp, timestamp, row[0]]
+                else:
+                    # 游标对应的日志已被删除，只按时间定位
+                    cond += "timestamp < ?"
+                    params = params + [timestamp]
+            rows = conn.execute(
+                f"SELECT {_ROW_COLUMNS}, seq FROM {self.table}{cond} "
+                f"ORDER BY timestamp DESC, seq DESC LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [self._from_row(row[:-1]) for row in rows], total, [row[-1] for row in rows]
+
+    def query_run(self, run_id: str) -> List[Dict[str, Any]]:
+        """查询一次运行的全部日志，结果按写入顺序排列"""
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT {_ROW_COLUMNS} FROM {self.table} WHERE run_id = ? ORDER BY seq",
+                (run_id,)
+            ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def oldest_timestamp(self, source: Optional[str] = None) -> Optional[str]:
+        """指定来源最早一条日志的时间，没有日志时返回None"""
+        where, params = self._where(source, None)
+        with self._lock:
+            return self._connect().execute(f"SELECT MIN(timestamp) FROM {self.table}{where}", params).fetchone()[0]
+
+    def iter_entries(self, reverse: bool = False) -> Iterator[Dict[str, Any]]:
+        """按写入顺序遍历所有日志，每次读取一批"""
+        order = "DESC" if reverse else "ASC"
+        last_seq = None
+        while True:
+            with self._lock:
+                if last_seq is None:
+                    cond, params = "", []
+                else:
+                    cond, params = (" WHERE seq < ?" if reverse else " WHERE seq > ?"), [last_seq]
+                rows = self._connect().execute(
+                    f"SELECT {_ROW_COLUMNS}, seq FROM {self.table}{cond} "
+                    f"ORDER BY seq {order} LIMIT 500",
+                    params
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._from_row(row)
+            last_seq = rows[-1][-1]
+
+    # ---- 删除与保留 ----
+
+    def delete(self, source: Optional[str] = None, level: Optional[str] = None) -> int:
+        """
+        删除指定来源/级别的日志
+
+        Returns:
+            删除的日志数量
+        """
+        where, params = self._where(source, level)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(f"DELETE FROM {self.table}{where}", params).rowcount
+
+    def clear(self) -> int:
+        """删除全部日志，返回删除的数量"""
+        return self.delete()
+
+    def pop_older_than(self, min_timestamp: str) -> List[Dict[str, Any]]:
+        """
+        取出并删除早于指定时间的日志，用于归档
+
+        Returns:
+            被删除的日志，按写入顺序排列
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                rows = conn.execute(
+                    f"SELECT {_ROW_COLUMNS} FROM {self.table} WHERE timestamp < ? ORDER BY seq", (min_timestamp,)
+                ).fetchall()
+                conn.execute(f"DELETE FROM {self.table} WHERE timestamp < ?", (min_timestamp,))
+        return [self._from_row(row) for row in rows]
+
+    def compact(self, min_timestamp: Optional[str] = None, max_entries: Optional[int] = None,
+                max_entries_per_source: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+        """
+        按保留策略删除日志，由后台压缩任务调用
+
+        Args:
+            min_timestamp: 早于该时间的日志被删除
+            max_entries: 日志总数上限
+            max_entries_per_source: 每个来源的日志数上限，各来源互不影响
+            max_bytes: 该类型日志的数据大小上限，按平均行大小估算需要删除的最旧日志
+
+        Returns:
+            删除的日志数量
+        """
+        t = self.table
+        removed = 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                if min_timestamp:
+                    removed += conn.execute(f"DELETE FROM {t} WHERE timestamp < ?", (min_timestamp,)).rowcount
+
+                if max_entries_per_source:
+                    noisy_sources = conn.execute(
+                        f"SELECT source FROM {t} GROUP BY source HAVING COUNT(*) > ?", (max_entries_per_source,)
+                    ).fetchall()
+                    for (source,) in noisy_sources:
+                        removed += conn.execute(
+                            f"DELETE FROM {t} WHERE source = ? AND seq <= "
+                            f"(SELECT seq FROM {t} WHERE source = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                            (source, source, max_entries_per_source)
+                        ).rowcount
+
+                if max_bytes:
+                    # 按本表各行的数据大小计算，不使用数据库文件大小：文件不会因删除而缩小，
+                    # 还包含WAL文件和另一种日志的表，按文件大小估算每次压缩都会再删除一部分
+                    total, data_bytes = conn.execute(
+                        f"SELECT COUNT(*), COALESCE(SUM({_ROW_BYTES}), 0) FROM {t}"
+                    ).fetchone()
+                    if total and data_bytes > max_bytes:
+                        keep = int(total * max_bytes / data_bytes)
+                        max_entries = min(max_entries, keep) if max_entries else keep
+
+                if max_entries is not None:
+                    removed += conn.execute(
+                        f"DELETE FROM {t} WHERE seq <= (SELECT seq FROM {t} ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                        (max_entries,)
+                    ).rowcount
+        return removed
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
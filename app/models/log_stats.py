@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+from app.utils.file_lock import FileLock
+
+# 按小时统计保留的天数，按天统计保留的天数
+HOUR_RETENTION_DAYS = 7
+DAY_RETENTION_DAYS = 400
+
+# 统计写入文件的最小间隔（秒），两次写入之间的变化只保存在内存中
+SAVE_INTERVAL = 5.0
+
+LEVELS = ("debug", "info", "warning", "error")
+
+
+class LogStats:
+    """
+    增量维护的日志统计
+
+    日志写入存储时同步累加按级别、按工作流、按小时和按天划分的计数，查询统计无需扫描日志。
+    统计的是产生的日志数量，日志被保留策略删除或归档后计数不变；手动清除日志时对应的计数一并清除。
+    每个进程只记录自己新增的计数，保存时在文件锁内与文件中的统计合并，多个进程的计数不会互相覆盖。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 统计文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Any]] = None
+        # 上次保存后本进程新增的计数，格式与统计数据相同
+        self._delta = self._empty()
+        self._dirty = False
+        self._last_save = 0.0
+        self._file_lock = FileLock(path + ".lock")
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        """
+        统计数据格式：
+            levels: {日志类型: {级别: 数量}}
+            hours/days: {日志类型: {小时或日期: {级别: 数量}}}
+            sources: {工作流ID: {级别: 数量}}
+            source_days: {工作流ID: {日期: {级别: 数量}}}
+        """
+        return {"levels": {}, "hours": {}, "days": {}, "sources": {}, "source_days": {}}
+
+    def _read_file(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return {**self._empty(), **json.load(f)}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return self._empty()
+
+    def _load(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = self._read_file()
+        return self._data
+
+    @classmethod
+    def _merge(cls, target: Dict[str, Any], delta: Dict[str, Any]):
+        """将增量计数累加到target"""
+        for key, value in delta.items():
+            if isinstance(value, dict):
+                cls._merge(target.setdefault(key, {}), value)
+            else:
+                target[key] = target.get(key, 0) + value
+
+    def _write_file(self, data: Dict[str, Any]):
+        """在文件锁内调用"""
+        self._prune(data)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self._data = data
+        self._delta = self._empty()
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def exists(self) -> bool:
+        """统计文件是否已经存在"""
+        return os.path.exists(self.path)
+
+    @staticmethod
+    def _bump(counts: Dict[str, int], level: str, n: int = 1):
+        counts[level] = counts.get(level, 0) + n
+
+    # ---- 写入 ----
+
+    def add(self, log_type: str, entries: List[Dict[str, Any]]):
+        """累加一批新写入的日志"""
+        if not entries:
+            return
+        with self._lock:
+            # 内存中的统计和待保存的增量同时累加
+            for data in (self._load(), self._delta):
+                self._count(data, log_type, entries)
+            self._dirty = True
+        self.save()
+
+    @classmethod
+    def _count(cls, data: Dict[str, Any], log_type: str, entries: List[Dict[str, Any]]):
+        levels = data["levels"].setdefault(log_type, {})
+        hours = data["hours"].setdefault(log_type, {})
+        days = data["days"].setdefault(log_type, {})
+        for entry in entries:
+            level = entry.get("level") or "info"
+            timestamp = entry.get("timestamp") or ""
+            cls._bump(levels, level)
+            cls._bump(hours.setdefault(timestamp[:13], {}), level)
+            cls._bump(days.setdefault(timestamp[:10], {}), level)
+            if log_type == "workflow":
+                source = str(entry.get("source", ""))
+                cls._bump(data["sources"].setdefault(source, {}), level)
+                cls._bump(data["source_days"].setdefault(source, {}).setdefault(timestamp[:10], {}), level)
+
+    def _prune(self, data: Dict[str, Any]):
+        """删除超出保留天数的小时和日期统计"""
+        hour_cutoff = (datetime.now() - timedelta(days=HOUR_RETENTION_DAYS)).strftime("%Y-%m-%dT%H")
+        day_cutoff = (datetime.now() - timedelta(days=DAY_RETENTION_DAYS)).strftime("%Y-%m-%d")
+        for buckets, cutoff in [(h, hour_cutoff) for h in data["hours"].values()] + \
+                               [(d, day_cutoff) for d in data["days"].values()] + \
+                               [(d, day_cutoff) for d in data["source_days"].values()]:
+            for key in [k for k in buckets if k < cutoff]:
+                del buckets[key]
+
+    def save(self, force: bool = False):
+        """将新增的计数合并到统计文件，距上次写入不足SAVE_INTERVAL秒时跳过，除非force为True"""
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._last_save < SAVE_INTERVAL):
+                return
+            with self._file_lock:
+                data = self._read_file()
+                self._merge(data, self._delta)
+                self._write_file(data)
+
+    def remove_source(self, source: str):
+        """清除一个工作流的统计，工作流日志被清除时调用"""
+        with self._lock, self._file_lock:
+            data = self._read_file()
+            self._merge(data, self._delta)
+            removed = data["sources"].pop(source, {})
+            removed_days = data["source_days"].pop(source, {})
+            # 从工作流日志的总计和按天统计中扣除，按小时统计无法按工作流区分，保持不变
+            levels = data["levels"].get("workflow", {})
+            for level, n in removed.items():
+                levels[level] = max(levels.get(level, 0) - n, 0)
+            days = data["days"].get("workflow", {})
+            for day, counts in removed_days.items():
+                for level, n in counts.items():
+                    if day in days:
+                        days[day][level] = max(days[day].get(level, 0) - n, 0)
+            self._write_file(data)
+
+    def reset(self, log_type: Optional[str] = None):
+        """清除指定类型日志的统计，None表示全部清除"""
+        with self._lock, self._file_lock:
+            data = self._read_file()
+            self._merge(data, self._delta)
+            if log_type is None:
+                data = self._empty()
+            else:
+                for key in ("levels", "hours", "days"):
+                    data[key].pop(log_type, None)
+                if log_type == "workflow":
+                    data["sources"] = {}
+                    data["source_days"] = {}
+            self._write_file(data)
+
+    # ---- 查询 ----
+
+    @staticmethod
+    def _sum(buckets: Dict[str, Dict[str, int]], keys: List[str]) -> Dict[str, int]:
+        total = dict.fromkeys(LEVELS, 0)
+        for key in keys:
+            for level, n in buckets.get(key, {}).items():
+                total[level] = total.get(level, 0) + n
+        return total
+
+    def summary(self, workflow_id: Optional[str] = None, days: int = 7) -> Dict[str, Any]:
+        """
+        获取统计摘要
+
+        Args:
+            workflow_id: 工作流ID，指定时只统计该工作流的日志
+            days: 按天统计返回的天数
+
+        Returns:
+            包含总计、最近24小时、最近days天每天的统计；未指定工作流时还包含各工作流在这段时间内的统计
+        """
+        now = datetime.now()
+        day_keys = [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days - 1, -1, -1)]
+        hour_keys = [(now - timedelta(hours=i)).strftime("%Y-%m-%dT%H") for i in range(23, -1, -1)]
+        with self._lock:
+            data = self._load()
+            if workflow_id is not None:
+                source_days = data["source_days"].get(workflow_id, {})
+                return {
+                    "workflow_id": workflow_id,
+                    "total": self._sum({"all": data["sources"].get(workflow_id, {})}, ["all"]),
+                    "period": self._sum(source_days, day_keys),
+                    "days": [{"day": day, "counts": self._sum(source_days, [day])} for day in day_keys],
+                }
+
+            result: Dict[str, Any] = {"total": {}, "last_24h": {}, "period": {}, "days": [], "hours": [], "workflows": {}}
+            for log_type in ("system", "workflow"):
+                result["total"][log_type] = self._sum({"all": data["levels"].get(log_type, {})}, ["all"])
+                result["last_24h"][log_type] = self._sum(data["hours"].get(log_type, {}), hour_keys)
+                result["period"][log_type] = self._sum(data["days"].get(log_type, {}), day_keys)
+            for day in day_keys:
+                result["days"].append({
+                    "day": day,
+                    "counts": {t: self._sum(data["days"].get(t, {}), [day]) for t in ("system", "workflow")},
+                })
+            for hour in hour_keys:
+                result["hours"].append({
+                    "hour": hour,
+                    "counts": {t: self._sum(data["hours"].get(t, {}), [hour]) for t in ("system", "workflow")},
+                })
+            for source, source_days in data["source_days"].items():
+                period = self._sum(source_days, day_keys)
+                if any(period.values()):
+                    result["workflows"][source] = period
+            return result
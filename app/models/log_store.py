@@ -0,0 +1,862 @@
+import os
+import re
+import json
+import heapq
+import shutil
+import struct
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Any, Optional, Iterator, Callable, Tuple
+
+from app.utils.file_lock import FileLock
+
+# 单个日志分段文件的默认大小上限（字节），超过后滚动到新分段
+DEFAULT_SEGMENT_MAX_BYTES = 1024 * 1024
+
+# 分段文件扩展名
+SEGMENT_SUFFIX = ".ndjson"
+
+# 索引记录格式：分段序号(uint32) + 记录在分段内的字节偏移(uint64)，定长便于按位置随机读取
+INDEX_RECORD = struct.Struct("<IQ")
+INDEX_SUFFIX = ".idx"
+
+# 可以直接用作文件名的来源ID
+_SAFE_KEY = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+logger = logging.getLogger("log_store")
+
+# 流式读取JSON数组时每次读取的字符数
+JSON_STREAM_CHUNK_CHARS = 64 * 1024
+
+
+def iter_json_array(path: str, chunk_chars: int = JSON_STREAM_CHUNK_CHARS) -> Iterator[Any]:
+    """
+    流式读取JSON数组文件，逐个返回数组元素
+
+    每次只读取一块内容并解析其中完整的元素，内存占用与单个元素大小相关，与文件大小无关。
+
+    Raises:
+        ValueError: 文件内容不是JSON数组
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read(chunk_chars).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{path} 不是JSON数组")
+        buf = buf[1:]
+        eof = False
+        while True:
+            buf = buf.lstrip().lstrip(",").lstrip()
+            if buf.startswith("]"):
+                return
+            try:
+                item, end = decoder.raw_decode(buf)
+                # 数字等元素恰好在块末尾结束时可能被截断，需要读到后面的分隔符才能确定
+                complete = end < len(buf) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # 当前块中的元素不完整，继续读取
+                chunk = f.read(chunk_chars)
+                eof = not chunk
+                buf += chunk
+                continue
+            yield item
+            buf = buf[end:]
+            if len(buf) < chunk_chars and not eof:
+                chunk = f.read(chunk_chars)
+                eof = not chunk
+                buf += chunk
+
+
+def iter_batches(entries: Iterator[Dict[str, Any]], size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+    """将日志按固定数量分批"""
+    batch: List[Dict[str, Any]] = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SegmentLogStore:
+    """
+    追加写入的分段日志存储
+
+    每条日志以一行JSON（NDJSON）追加到当前分段文件末尾，分段文件写满后滚动到新文件。
+    写入一条日志只需一次追加操作，与历史日志总量无关。
+
+    同时维护按来源和级别划分的二级索引，每个索引文件按写入顺序保存定长的
+    (分段序号, 偏移) 记录，因此按来源/级别过滤的分页查询只需读取该页对应的记录。
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = DEFAULT_SEGMENT_MAX_BYTES,
+                 legacy_file: Optional[str] = None, index_sources: bool = True):
+        """
+        Args:
+            directory: 分段文件所在目录
+            segment_max_bytes: 单个分段文件的大小上限
+            legacy_file: 旧版整文件JSON日志路径，首次打开时导入
+            index_sources: 是否按日志来源建立索引（系统日志只有一个来源，无需建立）
+        """
+        self.directory = directory
+        self.index_dir = os.path.join(directory, "index")
+        self.segment_max_bytes = segment_max_bytes
+        self.legacy_file = legacy_file
+        self.index_sources = index_sources
+        self._lock = threading.RLock()
+        self._segments: List[int] = []
+        self._counts: Dict[int, int] = {}
+        self._current_size = 0
+        self._loaded = False
+        # 多个进程写入同一目录时，写操作持有文件锁；除追加外的改写递增版本号，其他进程据此重新加载
+        self._file_lock = FileLock(directory + ".lock")
+        self._generation_path = directory + ".gen"
+        self._generation = 0
+
+    # ---- 内部工具 ----
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:08d}{SEGMENT_SUFFIX}")
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self._generation_path, "r") as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self):
+        """记录一次除追加以外的改写"""
+        self._generation = self._read_generation() + 1
+        tmp_path = f"{self._generation_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self._generation))
+        os.replace(tmp_path, self._generation_path)
+
+    def _count_lines(self, seq: int, start: int = 0) -> Tuple[int, int]:
+        """统计分段从start开始的完整行数，返回(行数, 文件大小)"""
+        with open(self._segment_path(seq), "rb") as f:
+            f.seek(start)
+            count = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(65536), b""))
+            return count, f.tell()
+
+    def _refresh(self):
+        """
+        同步其他进程的写入
+
+        其他进程只追加时，增量读取新增的行和分段；版本号变化说明分段被改写，重新加载。
+        """
+        if self._loaded and self._read_generation() == self._generation:
+            last = self._segments[-1] if self._segments else 0
+            try:
+                if self._segments and os.path.getsize(self._segment_path(last)) != self._current_size:
+                    count, self._current_size = self._count_lines(last, self._current_size)
+                    self._counts[last] += count
+                while os.path.exists(self._segment_path(last + 1)):
+                    last += 1
+                    self._counts[last], self._current_size = self._count_lines(last)
+                    self._segments.append(last)
+                return
+            except FileNotFoundError:
+                pass
+        self._loaded = False
+        self._load()
+
+    def _load(self):
+        """扫描目录，加载分段列表和每个分段的记录数"""
+        if self._loaded:
+            return
+        with self._file_lock:
+            self._load_locked()
+
+    def _load_locked(self):
+        self._generation = self._read_generation()
+        os.makedirs(self.directory, exist_ok=True)
+
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        segments.sort()
+
+        self._segments = segments
+        self._counts = {}
+        self._current_size = 0
+        for seq in segments:
+            self._counts[seq], self._current_size = self._count_lines(seq)
+        self._loaded = True
+
+        # 上次写入中断时索引可能落后于分段，重新生成
+        if not self._index_consistent():
+            self.rebuild_index()
+
+        self._import_legacy_file()
+
+    def _import_legacy_file(self):
+        """将旧版整文件JSON日志导入分段存储，导入后将旧文件重命名为备份"""
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        # 旧版日志按时间顺序追加写入，流式导入即可保持顺序
+        imported = 0
+        try:
+            entries = (entry for entry in iter_json_array(self.legacy_file) if isinstance(entry, dict))
+            for batch in iter_batches(entries):
+                self.append_many(batch)
+                imported += len(batch)
+        except Exception as e:
+            logger.error(f"读取旧日志文件失败: {str(e)}")
+            # 已导入部分日志时仍将旧文件改为备份，避免下次重复导入
+            if not imported:
+                return
+
+        os.replace(self.legacy_file, self.legacy_file + ".bak")
+
+    @staticmethod
+    def _encode(entry: Dict[str, Any]) -> bytes:
+        return (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _decode_lines(data: bytes) -> List[Dict[str, Any]]:
+        entries = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 跳过写入中断产生的残缺行
+                continue
+        return entries
+
+    def _read_segment(self, seq: int) -> List[Dict[str, Any]]:
+        try:
+            with open(self._segment_path(seq), "rb") as f:
+                return self._decode_lines(f.read())
+        except FileNotFoundError:
+            return []
+
+    # ---- 索引 ----
+
+    @staticmethod
+    def _source_key(source: str) -> str:
+        """来源ID对应的索引目录名"""
+        return source if _SAFE_KEY.match(source) else hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def _index_path(self, source: Optional[str] = None, level: Optional[str] = None) -> str:
+        """获取来源/级别组合对应的索引文件路径"""
+        if source is None:
+            return os.path.join(self.index_dir, (level or "all") + INDEX_SUFFIX)
+        return self._key_index_path(self._source_key(source), level)
+
+    def _key_index_path(self, key: str, level: Optional[str] = None) -> str:
+        return os.path.join(self.index_dir, "sources", key, (level or "all") + INDEX_SUFFIX)
+
+    def _run_index_path(self, run_id: str) -> str:
+        """运行ID对应的索引文件路径，按键的前两位分目录"""
+        key = self._source_key(run_id)
+        return os.path.join(self.index_dir, "runs", key[:2], key + INDEX_SUFFIX)
+
+    @staticmethod
+    def _index_boundary(path: str, keep: int) -> Optional[Tuple[int, int]]:
+        """
+        索引中记录数超过keep时，返回需要保留的最早一条记录的位置
+
+        位置早于该记录的日志都超出了保留数量。
+        """
+        if not os.path.exists(path):
+            return None
+        total = os.path.getsize(path) // INDEX_RECORD.size
+        if total <= keep:
+            return None
+        with open(path, "rb") as f:
+            f.seek((total - keep) * INDEX_RECORD.size)
+            return INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+
+    def _index_keys(self, entry: Dict[str, Any]) -> List[Tuple[Optional[str], Optional[str]]]:
+        level = entry.get("level") or "info"
+        keys = [(None, None), (None, level)]
+        if self.index_sources:
+            source = str(entry.get("source", ""))
+            keys.append((source, None))
+            keys.append((source, level))
+        return keys
+
+    def _write_index(self, records: List[Tuple[int, int, Optional[Dict[str, Any]]]]):
+        """
+        将 (分段序号, 偏移, 日志) 追加到对应的索引文件
+
+        无法解析的日志行只写入全量索引，保证全量索引与分段中的行一一对应。
+        """
+        grouped: Dict[str, List[bytes]] = {}
+        for seq, offset, entry in records:
+            packed = INDEX_RECORD.pack(seq, offset)
+            keys = self._index_keys(entry) if entry is not None else [(None, None)]
+            for source, level in keys:
+                grouped.setdefault(self._index_path(source, level), []).append(packed)
+            if entry is not None and entry.get("run_id"):
+                grouped.setdefault(self._run_index_path(str(entry["run_id"])), []).append(packed)
+        for path, packed_records in grouped.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(b"".join(packed_records))
+
+    def _index_consistent(self) -> bool:
+        """检查全量索引的最后一条记录是否正好指向最后一个分段的末尾"""
+        path = self._index_path()
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size % INDEX_RECORD.size:
+            return False
+        non_empty = [seq for seq in self._segments if self._counts.get(seq)]
+        if not non_empty:
+            return size == 0
+        if not size:
+            return False
+        with open(path, "rb") as f:
+            f.seek(size - INDEX_RECORD.size)
+            seq, offset = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+        if seq != non_empty[-1]:
+            return False
+        segment_path = self._segment_path(seq)
+        with open(segment_path, "rb") as f:
+            f.seek(offset)
+            line = f.readline()
+        return line.endswith(b"\n") and offset + len(line) == os.path.getsize(segment_path)
+
+    def rebuild_index(self):
+        """扫描全部分段重新生成索引，同时截掉分段末尾写入中断的残缺行"""
+        with self._lock, self._file_lock:
+            self._load()
+            self._bump_generation()
+            shutil.rmtree(self.index_dir, ignore_errors=True)
+            os.makedirs(self.index_dir, exist_ok=True)
+            for seq in self._segments:
+                path = self._segment_path(seq)
+                with open(path, "rb") as f:
+                    data = f.read()
+                if data and not data.endswith(b"\n"):
+                    data = data[:data.rfind(b"\n") + 1]
+                    with open(path, "r+b") as f:
+                        f.truncate(len(data))
+                    if seq == self._segments[-1]:
+                        self._current_size = len(data)
+
+                records = []
+                offset = 0
+                for line in data.splitlines(keepends=True):
+                    entry = None
+                    if line.strip():
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            pass
+                    records.append((seq, offset, entry))
+                    offset += len(line)
+                self._counts[seq] = len(records)
+                self._write_index(records)
+
+    # ---- 写入 ----
+
+    def append(self, entry: Dict[str, Any]):
+        """追加一条日志"""
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> bool:
+        """
+        批量追加日志
+
+        Returns:
+            本次写入是否滚动到了新分段
+        """
+        if not entries:
+            return False
+        rolled = False
+        with self._lock, self._file_lock:
+            # 持有文件锁后再同步其他进程的写入，确保偏移基于文件的实际末尾
+            self._refresh()
+            pending = []
+            pending_size = 0
+            index_records = []
+            for entry in entries:
+                data = self._encode(entry)
+                if not self._segments or (
+                    self._current_size + pending_size > 0
+                    and self._current_size + pending_size + len(data) > self.segment_max_bytes
+                ):
+                    self._write(pending)
+                    pending, pending_size = [], 0
+                    self._roll()
+                    rolled = True
+                index_records.append((self._segments[-1], self._current_size + pending_size, entry))
+                pending.append(data)
+                pending_size += len(data)
+            self._write(pending)
+            # 先写分段再写索引，中断时由下次加载时的一致性检查修复
+            self._write_index(index_records)
+        return rolled
+
+    def _write(self, lines: List[bytes]):
+        if not lines:
+            return
+        seq = self._segments[-1]
+        data = b"".join(lines)
+        with open(self._segment_path(seq), "ab") as f:
+            f.write(data)
+        self._current_size += len(data)
+        self._counts[seq] = self._counts.get(seq, 0) + len(lines)
+
+    def _roll(self):
+        seq = self._segments[-1] + 1 if self._segments else 1
+        self._segments.append(seq)
+        self._counts[seq] = 0
+        self._current_size = 0
+
+    # ---- 读取 ----
+
+    def count(self, source: Optional[str] = None, level: Optional[str] = None) -> int:
+        """
+        日志数量，按来源/级别过滤时直接由索引文件大小得出
+
+        Args:
+            source: 日志来源
+            level: 日志级别
+        """
+        with self._lock:
+            self._refresh()
+            if source is None and level is None:
+                return sum(self._counts.values())
+            if source is not None and not self.index_sources:
+                return 0
+            path = self._index_path(source, level)
+            return os.path.getsize(path) // INDEX_RECORD.size if os.path.exists(path) else 0
+
+    def query(self, source: Optional[str] = None, level: Optional[str] = None,
+              offset: int = 0, limit: int = 50) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        按来源和级别查询日志，结果按写入顺序倒序（最新的在前）
+
+        只读取索引中当前页对应的记录，再按偏移读取这些日志行。
+
+        Args:
+            source: 日志来源，None表示不限
+            level: 日志级别，None表示不限
+            offset: 跳过的条数
+            limit: 返回的最大条数
+
+        Returns:
+            (日志列表, 总数)
+        """
+        with self._lock:
+            self._refresh()
+            if source is not None and not self.index_sources:
+                return [], 0
+            path = self._index_path(source, level)
+            if not os.path.exists(path):
+                return [], 0
+            total = os.path.getsize(path) // INDEX_RECORD.size
+            end = total - offset
+            start = max(end - limit, 0)
+            if end <= 0:
+                return [], total
+            with open(path, "rb") as f:
+                positions = self._read_index_range(f, start, end)
+            positions.reverse()
+            return self._read_positions(positions), total
+
+    def query_before(self, source: Optional[str] = None, level: Optional[str] = None,
+                     cursor: Optional[Tuple[str, str, Any]] = None,
+                     limit: int = 50) -> Tuple[List[Dict[str, Any]], int, List[Any]]:
+        """
+        键集分页查询，返回排在游标之后（更早）的日志，结果按写入顺序倒序
+
+        游标带有日志的 (分段序号, 偏移) 时，在索引上按位置二分查找，并用日志ID校验，
+        每页的开销与翻到第几页无关。日志的时间与写入顺序不一定一致，按位置定位不会重复或遗漏日志。
+
+        Args:
+            source: 日志来源，None表示不限
+            level: 日志级别，None表示不限
+            cursor: 上一页最后一条日志的 (时间, ID, 位置)，位置可以为None，None表示从最新的日志开始
+            limit: 返回的最大条数
+
+        Returns:
+            (日志列表, 总数, 每条日志的位置)
+        """
+        with self._lock:
+            self._refresh()
+            if source is not None and not self.index_sources:
+                return [], 0, []
+            path = self._index_path(source, level)
+            if not os.path.exists(path):
+                return [], 0, []
+            total = os.path.getsize(path) // INDEX_RECORD.size
+            with open(path, "rb") as f:
+                end = self._cursor_position(f, total, cursor) if cursor else total
+                positions = self._read_index_range(f, max(end - limit, 0), end)
+            positions.reverse()
+            entries, read_positions = self._read_positions_with(positions)
+            return entries, total, [list(position) for position in read_positions]
+
+    @staticmethod
+    def _read_index_range(f, start: int, end: int) -> List[Tuple[int, int]]:
+        """读取索引文件中第start到end条（不含）记录"""
+        f.seek(start * INDEX_RECORD.size)
+        data = f.read((end - start) * INDEX_RECORD.size)
+        return [INDEX_RECORD.unpack_from(data, i) for i in range(0, len(data) - INDEX_RECORD.size + 1, INDEX_RECORD.size)]
+
+    def _entry_at(self, f, i: int) -> Dict[str, Any]:
+        """读取索引中第i条记录指向的日志，无法解析时返回空字典"""
+        entries = self._read_positions(self._read_index_range(f, i, i + 1))
+        return entries[0] if entries else {}
+
+    def _cursor_position(self, f, total: int, cursor: Tuple[str, str, Any]) -> int:
+        """
+        定位游标在索引中的位置，游标之前（更早写入）的记录属于下一页
+
+        索引记录按写入顺序追加，(分段序号, 偏移) 严格递增，按游标中的位置二分查找，
+        找到的日志ID与游标一致时直接使用。游标没有位置或日志已被删除、分段被改写时，
+        退化为按时间二分查找，此时时间与写入顺序不一致的日志可能重复或遗漏。
+        """
+        timestamp, log_id, position = cursor
+        if position is not None:
+            try:
+                target = (int(position[0]), int(position[1]))
+            except (TypeError, ValueError, IndexError):
+                target = None
+            if target is not None:
+                lo, hi = 0, total
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self._read_index_range(f, mid, mid + 1)[0] < target:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                if lo < total and self._read_index_range(f, lo, lo + 1)[0] == target \
+                        and self._entry_at(f, lo).get("id") == log_id:
+                    return lo
+
+        lo, hi = 0, total
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry_at(f, mid).get("timestamp", "") < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        # 时间相同的日志按写入顺序排列，向后找到游标对应的那一条
+        for i in range(lo, total):
+            entry = self._entry_at(f, i)
+            if entry.get("timestamp", "") != timestamp:
+                break
+            if entry.get("id") == log_id:
+                return i
+        return lo
+
+    def query_run(self, run_id: str) -> List[Dict[str, Any]]:
+        """
+        查询一次运行的全部日志，结果按写入顺序排列
+
+        只读取该运行的索引记录，与其他日志的数量无关。
+        """
+        with self._lock:
+            self._refresh()
+            path = self._run_index_path(run_id)
+            if not os.path.exists(path):
+                return []
+            with open(path, "rb") as f:
+                positions = self._read_index_range(f, 0, os.path.getsize(path) // INDEX_RECORD.size)
+            return self._read_positions(positions)
+
+    def oldest_timestamp(self, source: Optional[str] = None) -> Optional[str]:
+        """指定来源最早一条日志的时间，没有日志时返回None"""
+        with self._lock:
+            self._refresh()
+            if source is not None and not self.index_sources:
+                return None
+            path = self._index_path(source)
+            if not os.path.exists(path) or os.path.getsize(path) < INDEX_RECORD.size:
+                return None
+            with open(path, "rb") as f:
+                return self._entry_at(f, 0).get("timestamp")
+
+    def _read_positions(self, positions: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """按 (分段序号, 偏移) 读取日志行"""
+        return self._read_positions_with(positions)[0]
+
+    def _read_positions_with(self, positions: List[Tuple[int, int]]) -> Tuple[List[Dict[str, Any]], List[Tuple[int, int]]]:
+        """按 (分段序号, 偏移) 读取日志行，同时返回成功读取的每条日志的位置"""
+        entries = []
+        read_positions = []
+        handles = {}
+        try:
+            for seq, offset in positions:
+                f = handles.get(seq)
+                if f is None:
+                    try:
+                        f = handles[seq] = open(self._segment_path(seq), "rb")
+                    except FileNotFoundError:
+                        continue
+                f.seek(offset)
+                line = f.readline()
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+                read_positions.append((seq, offset))
+        finally:
+            for f in handles.values():
+                f.close()
+        return entries, read_positions
+
+    def iter_entries(self, reverse: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        按写入顺序遍历所有日志
+
+        Args:
+            reverse: 为True时从最新的日志开始遍历
+        """
+        with self._lock:
+            self._refresh()
+            segments = list(self._segments)
+        if reverse:
+            segments.reverse()
+        for seq in segments:
+            entries = self._read_segment(seq)
+            if reverse:
+                entries.reverse()
+            yield from entries
+
+    # ---- 删除与保留 ----
+
+    def rewrite(self, keep: Callable[[Dict[str, Any]], bool]) -> int:
+        """
+        重写分段，只保留满足条件的日志
+
+        Args:
+            keep: 判断日志是否保留的函数
+
+        Returns:
+            删除的日志数量
+        """
+        removed = 0
+        with self._lock, self._file_lock:
+            self._refresh()
+            for seq in list(self._segments):
+                entries = self._read_segment(seq)
+                kept = [entry for entry in entries if keep(entry)]
+                if len(kept) == len(entries):
+                    continue
+                removed += len(entries) - len(kept)
+                path = self._segment_path(seq)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(b"".join(self._encode(entry) for entry in kept))
+                os.replace(tmp_path, path)
+                self._counts[seq] = len(kept)
+                if seq == self._segments[-1]:
+                    self._current_size = os.path.getsize(path)
+            # 记录偏移已经改变，重新生成索引
+            if removed:
+                self.rebuild_index()
+        return removed
+
+    def delete(self, source: Optional[str] = None, level: Optional[str] = None) -> int:
+        """
+        删除指定来源/级别的日志
+
+        先由索引判断是否有匹配的日志，没有时不读取任何分段。
+
+        Returns:
+            删除的日志数量
+        """
+        if source is None and level is None:
+            return self.clear()
+        if not self.count(source, level):
+            return 0
+
+        def keep(entry: Dict[str, Any]) -> bool:
+            if source is not None and entry.get("source") != source:
+                return True
+            return level is not None and entry.get("level") != level
+
+        return self.rewrite(keep)
+
+    def merge_sorted(self, entries: Iterator[Dict[str, Any]]):
+        """
+        将按时间排序的日志与已有日志按时间归并，写入新的分段目录后替换当前存储
+
+        整个归并过程持有线程锁和文件锁，期间其他线程和进程的追加会等待归并完成后再写入，
+        不会因替换目录而丢失。内存占用与日志总量无关。
+
+        Args:
+            entries: 按时间排序的日志
+        """
+        with self._lock, self._file_lock:
+            self._refresh()
+            staging_dir = self.directory + ".migrating"
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            os.makedirs(staging_dir)
+            staging = SegmentLogStore(staging_dir, self.segment_max_bytes, index_sources=self.index_sources)
+            existing = (entry for seq in list(self._segments) for entry in self._read_segment(seq))
+            merged = heapq.merge(existing, entries, key=lambda x: x.get("timestamp", ""))
+            for batch in iter_batches(merged):
+                staging.append_many(batch)
+            self.replace_with(staging_dir)
+            for path in (staging_dir + ".lock", staging_dir + ".gen"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def replace_with(self, directory: str):
+        """
+        用另一个分段存储目录的内容替换当前存储，原有日志全部删除
+
+        Args:
+            directory: 已写好的分段存储目录，替换后该目录不再存在
+        """
+        with self._lock, self._file_lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.replace(directory, self.directory)
+            self._bump_generation()
+            self._loaded = False
+            self._load()
+
+    def clear(self) -> int:
+        """删除全部日志，返回删除的数量"""
+        with self._lock, self._file_lock:
+            self._refresh()
+            count = sum(self._counts.values())
+            for seq in self._segments:
+                try:
+                    os.remove(self._segment_path(seq))
+                except FileNotFoundError:
+                    pass
+            shutil.rmtree(self.index_dir, ignore_errors=True)
+            self._segments = []
+            self._counts = {}
+            self._current_size = 0
+            self._bump_generation()
+            return count
+
+    def _first_timestamp(self, seq: int) -> str:
+        """分段中第一条日志的时间"""
+        try:
+            with open(self._segment_path(seq), "rb") as f:
+                return json.loads(f.readline()).get("timestamp", "")
+        except (FileNotFoundError, json.JSONDecodeError):
+            return ""
+
+    def pop_older_than(self, min_timestamp: str) -> List[Dict[str, Any]]:
+        """
+        取出并删除早于指定时间的日志，用于归档
+
+        与compact的按时间删除使用相同的分段范围，返回的正是被删除的日志。
+
+        Returns:
+            被删除的日志，按写入顺序排列
+        """
+        with self._lock, self._file_lock:
+            self._refresh()
+            entries = []
+            for seq in self._segments:
+                if self._first_timestamp(seq) >= min_timestamp:
+                    break
+                entries.extend(e for e in self._read_segment(seq) if e.get("timestamp", "") < min_timestamp)
+            if entries:
+                self.compact(min_timestamp=min_timestamp)
+            return entries
+
+    def compact(self, min_timestamp: Optional[str] = None, max_entries: Optional[int] = None,
+                max_entries_per_source: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+        """
+        按保留策略删除日志，由后台压缩任务调用
+
+        Args:
+            min_timestamp: 早于该时间的日志被删除
+            max_entries: 日志总数上限
+            max_entries_per_source: 每个来源的日志数上限，各来源互不影响
+            max_bytes: 分段文件总大小上限，超过时删除最旧的整个分段
+
+        Returns:
+            删除的日志数量
+        """
+        removed = 0
+        with self._lock, self._file_lock:
+            self._refresh()
+
+            # 超过总大小上限时直接删除最旧的整个分段
+            if max_bytes:
+                sizes = {seq: os.path.getsize(self._segment_path(seq)) for seq in self._segments}
+                total_bytes = sum(sizes.values())
+                while len(self._segments) > 1 and total_bytes > max_bytes:
+                    seq = self._segments.pop(0)
+                    total_bytes -= sizes[seq]
+                    removed += self._counts.pop(seq)
+                    os.remove(self._segment_path(seq))
+
+            # 由索引找出总数和每个来源需要保留的最早位置
+            global_boundary = self._index_boundary(self._index_path(), max_entries) if max_entries else None
+            source_boundaries: Dict[str, Tuple[int, int]] = {}
+            sources_dir = os.path.join(self.index_dir, "sources")
+            if max_entries_per_source and os.path.isdir(sources_dir):
+                for key in os.listdir(sources_dir):
+                    boundary = self._index_boundary(self._key_index_path(key), max_entries_per_source)
+                    if boundary:
+                        source_boundaries[key] = boundary
+            max_boundary_seq = max(
+                [b[0] for b in source_boundaries.values()] + ([global_boundary[0]] if global_boundary else []),
+                default=0
+            )
+
+            for seq in list(self._segments):
+                too_old = bool(min_timestamp) and self._first_timestamp(seq) < min_timestamp
+                if seq > max_boundary_seq and not too_old:
+                    # 分段按时间顺序排列，后面的分段不会再有需要删除的日志
+                    break
+                path = self._segment_path(seq)
+                with open(path, "rb") as f:
+                    data = f.read()
+                kept = []
+                offset = 0
+                for line in data.splitlines(keepends=True):
+                    position = (seq, offset)
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if min_timestamp and entry.get("timestamp", "") < min_timestamp:
+                        continue
+                    if global_boundary and position < global_boundary:
+                        continue
+                    boundary = source_boundaries.get(self._source_key(str(entry.get("source", ""))))
+                    if boundary and position < boundary:
+                        continue
+                    kept.append(line)
+                if len(kept) == self._counts.get(seq, 0):
+                    continue
+                removed += self._counts.get(seq, 0) - len(kept)
+                if not kept and seq != self._segments[-1]:
+                    os.remove(path)
+                    self._segments.remove(seq)
+                    self._counts.pop(seq, None)
+                    continue
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(b"".join(kept))
+                os.replace(tmp_path, path)
+                self._counts[seq] = len(kept)
+                if seq == self._segments[-1]:
+                    self._current_size = os.path.getsize(path)
+
+            # 记录位置已经改变，重新生成索引
+            if removed:
+                self.rebuild_index()
+        return removed
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+from typing import Dict, List, Any, Optional
+
+# 每个订阅者的队列上限，客户端消费过慢时丢弃新日志
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class LogSubscription:
+    """
+    日志订阅，保存过滤条件和接收日志的异步队列
+
+    日志在任意线程中发布，通过事件循环的call_soon_threadsafe投递到队列。
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, log_type: Optional[str] = None,
+                 source: Optional[str] = None, level: Optional[str] = None, run_id: Optional[str] = None):
+        """
+        Args:
+            loop: 订阅者所在的事件循环
+            log_type: 日志类型，'system' 或 'workflow'，None表示不限
+            source: 日志来源（工作流ID），None表示不限
+            level: 日志级别，None表示不限
+            run_id: 运行ID，None表示不限
+        """
+        self.loop = loop
+        self.log_type = log_type
+        self.source = source
+        self.level = level
+        self.run_id = run_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, log_type: str, entry: Dict[str, Any]) -> bool:
+        return (
+            (self.log_type is None or self.log_type == log_type)
+            and (self.source is None or self.source == entry.get("source"))
+            and (self.level is None or self.level == entry.get("level"))
+            and (self.run_id is None or self.run_id == entry.get("run_id"))
+        )
+
+    def _deliver(self, entry: Dict[str, Any]):
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待下一条日志，超时返回None"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LogBroadcaster:
+    """进程内的日志发布/订阅，没有订阅者时发布几乎没有开销"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: List[LogSubscription] = []
+
+    def subscribe(self, **filters) -> LogSubscription:
+        """在当前事件循环中创建订阅，过滤条件见LogSubscription"""
+        subscription = LogSubscription(asyncio.get_running_loop(), **filters)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: LogSubscription):
+        """取消订阅"""
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscription]
+
+    def publish(self, log_type: str, entry: Dict[str, Any]):
+        """向过滤条件匹配的订阅者投递一条日志，可在任意线程中调用"""
+        # 订阅列表整体替换，读取时无需加锁
+        for subscription in self._subscribers:
+            if subscription.matches(log_type, entry):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription._deliver, entry)
+                except RuntimeError:
+                    # 事件循环已关闭
+                    self.unsubscribe(subscription)
+
+    def subscriber_count(self) -> int:
+        """当前订阅者数量"""
+        return len(self._subscribers)
@@ -27,7 +27,7 @@ except ImportError:
 
 # 导入工具模块
 from app.utils.config import get_config, get_variable, set_variable, get_variables, update_variables, get_account_info, get_account_config, update_account_config, update_account_field
-from app.models.log import log_workflow_action
+from app.models.log import log_workflow_action, is_log_enabled, start_run, get_run_id
 from app.utils.notification import send_notification
 from app.models.module_types import MODULE_TYPES, get_all_module_types
 
@@ -87,19 +87,21 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
     module_name = module.get("name", "未命名模块")
     config = module.get("config", {})
     result = {"success": True, "output": None, "error": None}
+    # 未启用调试日志时跳过调试信息的格式化和记录
+    debug_log = bool(workflow_id) and is_log_enabled("debug")
     
     try:
         if module_type == "md5":
             input_text = replace_variables(config.get("input", ""), variables)
             # 记录输入参数
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输入: {input_text}", {"module_type": module_type})
             
             md5_hash = hashlib.md5(input_text.encode()).hexdigest()
             result["output"] = md5_hash
             
             # 记录输出结果
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输出: {md5_hash}", {"module_type": module_type})
             
             if config.get("output_var"):
@@ -108,14 +110,14 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
         elif module_type == "base64_encode":
             input_text = replace_variables(config.get("input", ""), variables)
             # 记录输入参数
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输入: {input_text}", {"module_type": module_type})
             
             encoded = base64.b64encode(input_text.encode()).decode()
             result["output"] = encoded
             
             # 记录输出结果
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输出: {encoded}", {"module_type": module_type})
             
             if config.get("output_var"):
@@ -124,7 +126,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
         elif module_type == "base64_decode":
             input_text = replace_variables(config.get("input", ""), variables)
             # 记录输入参数
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输入: {input_text}", {"module_type": module_type})
             
             try:
@@ -132,7 +134,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 result["output"] = decoded
                 
                 # 记录输出结果
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输出: {decoded}", {"module_type": module_type})
                 
                 if config.get("output_var"):
@@ -149,7 +151,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             replace_text = replace_variables(config.get("replace", ""), variables)
             
             # 记录输入参数
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 替换操作", {
                     "module_type": module_type,
                     "input": input_text,
@@ -161,7 +163,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             result["output"] = replaced
             
             # 记录输出结果
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 替换结果: {replaced}", {"module_type": module_type})
             
             if config.get("output_var"):
@@ -170,14 +172,14 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
         elif module_type == "url_encode":
             input_text = replace_variables(config.get("input", ""), variables)
             # 记录输入参数
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输入: {input_text}", {"module_type": module_type})
             
             encoded = urllib.parse.quote(input_text)
             result["output"] = encoded
             
             # 记录输出结果
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输出: {encoded}", {"module_type": module_type})
             
             if config.get("output_var"):
@@ -186,7 +188,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
         elif module_type == "url_decode":
             input_text = replace_variables(config.get("input", ""), variables)
             # 记录输入参数
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输入: {input_text}", {"module_type": module_type})
             
             try:
@@ -194,7 +196,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 result["output"] = decoded
                 
                 # 记录输出结果
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输出: {decoded}", {"module_type": module_type})
                 
                 if config.get("output_var"):
@@ -232,7 +234,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             timeout = int(config.get("timeout", 30))
             
             # 记录请求信息
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' HTTP请求", {
                     "module_type": module_type,
                     "url": url,
@@ -276,7 +278,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                     result["output"] = response_text
                     
                     # 记录响应信息
-                    if workflow_id:
+                    if debug_log:
                         # 获取响应头信息，转换为字典形式
                         response_headers = dict(response.headers)
                         log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' HTTP响应 {response.status_code}", {
@@ -308,7 +310,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             path = config.get("path", "")
             
             # 记录输入参数
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' JSON解析", {
                     "module_type": module_type,
                     "input": input_text[:1000] + ("..." if len(input_text) > 1000 else ""),
@@ -327,7 +329,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 result["output"] = parsed_value_str
                 
                 # 记录解析结果
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' JSON解析结果", {
                         "module_type": module_type,
                         "parsed_value": parsed_value_str[:1000] + ("..." if len(parsed_value_str) > 1000 else "")
@@ -346,7 +348,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             var_value = replace_variables(config.get("value", ""), variables)
             
             # 记录设置变量操作
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 设置变量", {
                     "module_type": module_type,
                     "variable_name": var_name,
@@ -361,7 +363,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             template = config.get("template", "")
             
             # 记录模板内容
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 文本模板", {
                     "module_type": module_type,
                     "template": template[:1000] + ("..." if len(template) > 1000 else "")
@@ -371,7 +373,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             result["output"] = output
             
             # 记录生成结果
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 文本模板生成结果", {
                     "module_type": module_type,
                     "output": output[:1000] + ("..." if len(output) > 1000 else "")
@@ -387,7 +389,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             to = replace_variables(config.get("to", ""), variables)
             
             # 记录通知内容
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 发送通知", {
                     "module_type": module_type,
                     "notification_type": notification_type,
@@ -429,7 +431,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                         smtp_password = email_config.get("smtp_password")
                         
                         # 记录将要使用的收件人地址
-                        if workflow_id:
+                        if debug_log:
                             log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 准备发送邮件", {
                                 "module_type": module_type,
                                 "smtp_server": smtp_server,
@@ -520,7 +522,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                         wxpusher_data["uids"] = [to]
                         
                         # 记录将要使用的接收人UID
-                        if workflow_id:
+                        if debug_log:
                             log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 准备发送微信推送", {
                                 "module_type": module_type,
                                 "app_token": wxpusher_config.get("app_token"),
@@ -535,7 +537,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                             response_json = response.json()
                             
                             # 记录推送响应
-                            if workflow_id:
+                            if debug_log:
                                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' WxPusher响应", {
                                     "module_type": module_type,
                                     "response": response_json
@@ -591,7 +593,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                             response_json = response.json()
                             
                             # 记录推送响应
-                            if workflow_id:
+                            if debug_log:
                                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' PushPlus响应", {
                                     "module_type": module_type,
                                     "response": response_json
@@ -625,7 +627,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             encoding = config.get("encoding", "base64")
             
             # 记录输入
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输入: {input_text[:100]}", {"module_type": module_type})
             
             try:
@@ -670,7 +672,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 result["output"] = encrypted
                 
                 # 记录输出
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输出: {encrypted[:100]}", {"module_type": module_type})
                 
                 if config.get("output_var"):
@@ -690,7 +692,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             encoding = config.get("encoding", "base64")
             
             # 记录输入
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输入: {input_text[:100]}", {"module_type": module_type})
             
             try:
@@ -736,7 +738,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 result["output"] = decrypted
                 
                 # 记录输出
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 输出: {decrypted[:100]}", {"module_type": module_type})
                 
                 if config.get("output_var"):
@@ -756,7 +758,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             false_branch = config.get("false_branch", "if_false")
             
             # 记录条件判断
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 条件判断: {input_value} {condition} {compare_value}", {"module_type": module_type})
             
             # 条件判断
@@ -786,7 +788,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             result["branch"] = true_branch if condition_result else false_branch
             
             # 记录判断结果
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 条件结果: {condition_result}, 分支: {result['branch']}", {"module_type": module_type})
             
             # 设置变量
@@ -803,7 +805,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             result["output"] = "条件判断结束"
             
             # 记录
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 条件判断结束", {"module_type": module_type})
                 
         elif module_type == "repeat":
@@ -812,7 +814,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             interval = config.get("interval", 0)
             
             # 记录重复操作
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 重复执行模块 {target_module} {times}次", {"module_type": module_type})
             
             # 存储重复状态
@@ -828,7 +830,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             output_var = config.get("output_var", "")
             
             # 记录操作信息
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 生成随机数", {
                     "module_type": module_type,
                     "random_type": random_type
@@ -841,7 +843,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 random_value = random.randint(min_val, max_val)
                 result["output"] = str(random_value)
                 
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 生成整数随机数", {
                         "module_type": module_type,
                         "range": f"{min_val} - {max_val}",
@@ -863,7 +865,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 random_value = ''.join(random.choice(chars) for _ in range(length))
                 result["output"] = random_value
                 
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 生成随机字符串", {
                         "module_type": module_type,
                         "length": length,
@@ -882,7 +884,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             output_var = config.get("output_var", "")
             
             # 记录操作信息
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 处理时间戳", {
                     "module_type": module_type,
                     "action": action,
@@ -922,7 +924,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                     result["output"] = timestamp_value
                 
                 # 记录结果
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 时间戳结果", {
                         "module_type": module_type,
                         "result": result["output"]
@@ -945,7 +947,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             reset = config.get("reset", False)
             
             # 记录操作信息
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 设置系统代理", {
                     "module_type": module_type,
                     "proxy_url": proxy_url if not reset else "重置",
@@ -992,7 +994,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             category_key = category_mapping.get(category, "static_tokens")
             
             # 记录操作信息
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 账号配置操作", {
                     "module_type": module_type,
                     "action": action,
@@ -1021,7 +1023,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 result["output"] = field_value
                 
                 # 记录读取结果
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 读取账号配置", {
                         "module_type": module_type,
                         "category": category,
@@ -1121,7 +1123,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
                 return result
             
             # 记录域名检查开始
-            if workflow_id:
+            if debug_log:
                 log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 开始检查域名", {
                     "module_type": module_type,
                     "domains": domains,
@@ -1242,7 +1244,7 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
             # 如果需要所有结果，保存到变量
             if all_results_var:
                 variables[all_results_var] = json.dumps(results)
-                if workflow_id:
+                if debug_log:
                     log_workflow_action(workflow_id, "debug", f"模块 '{module_name}' 保存所有检查结果到变量 {all_results_var}", {
                         "module_type": module_type,
                         "results": results
@@ -1263,18 +1265,46 @@ async def execute_module(module: Dict[str, Any], variables: Dict[str, Any], work
         
     return result
 
-async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
-    """执行完整工作流"""
+class _ExecutionPlan:
+    """
+    工作流编译后的执行计划
+
+    保存排序后的执行步骤、每个步骤所属的分支、重复操作的目标模块和模块名称映射，
+    只记录模块在工作流modules列表中的下标，执行时从本次运行的工作流数据中取出模块。
+    """
+
+    __slots__ = ("steps", "module_index", "repeat_targets", "module_names")
+
+    def __init__(self, steps: List[Tuple[Union[int, str], str, int, Optional[str]]], module_index: Dict[str, int],
+                 repeat_targets: Dict[str, Optional[str]], module_names: Dict[str, str]):
+        self.steps = steps  # [(执行顺序号, 模块ID, 模块下标, 所属分支)]
+        self.module_index = module_index
+        self.repeat_targets = repeat_targets  # {重复操作模块ID: 目标模块ID}
+        self.module_names = module_names  # {模块ID: 可读名称}
+
+
+# 执行计划缓存：{工作流ID: (工作流内容哈希, 执行计划)}，内容变化后重新编译并替换
+_plan_cache: Dict[str, Tuple[str, _ExecutionPlan]] = {}
+
+
+def _workflow_plan_hash(workflow: Dict[str, Any]) -> str:
+    """执行计划依赖的工作流内容（模块和连接）的哈希"""
+    content = json.dumps(
+        {"modules": workflow.get("modules", []), "connections": workflow.get("connections", [])},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def _compile_workflow_plan(workflow: Dict[str, Any]) -> _ExecutionPlan:
+    """根据模块和连接计算执行顺序、分支和重复目标"""
     modules = workflow.get("modules", [])
     connections = workflow.get("connections", [])
     workflow_id = workflow.get("id")
-    workflow_name = workflow.get("name", "未命名工作流")
-    
-    # 记录工作流开始执行
-    log_workflow_action(workflow_id, "info", f"开始执行工作流: {workflow_name}")
     
     # 创建模块ID到模块的映射
     module_map = {module.get("id"): module for module in modules}
+    module_index = {module.get("id"): index for index, module in enumerate(modules)}
     
     # 创建模块依赖图
     dependency_graph = {}
@@ -1346,6 +1376,70 @@ async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
             module_order[module_id] = current_order
             current_order += 1
     
+    # 生成有序模块执行队列
+    ordered_modules = sorted([(module_order[mid], mid) for mid in execution_order])
+    steps = []
+    for order, module_id in ordered_modules:
+        # 条件分支内的模块记录所属分支
+        branch = order.split(".", 1)[1] if isinstance(order, str) and "." in order else None
+        steps.append((order, module_id, module_index[module_id], branch))
+    
+    # 重复操作模块按执行顺序号查找目标模块
+    repeat_targets = {}
+    for module_id, module in module_map.items():
+        if module.get("type") == "repeat":
+            target_module_order = module.get("config", {}).get("target_module", "")
+            repeat_targets[module_id] = next(
+                (mid for mo, mid in ordered_modules if str(mo) == str(target_module_order)), None
+            )
+    
+    # 创建模块ID到模块名称的映射
+    module_id_to_name = {}
+    for module_id, module in module_map.items():
+        module_name = module.get("name", "未命名模块")
+        module_type = module.get("type")
+        module_type_info = MODULE_TYPES.get(module_type, {})
+        module_type_name = module_type_info.get("name", module_type)
+        # 保存模块ID到可读名称的映射
+        module_id_to_name[module_id] = f"{module_name} ({module_type_name})"
+    
+    return _ExecutionPlan(steps, module_index, repeat_targets, module_id_to_name)
+
+
+def get_workflow_plan(workflow: Dict[str, Any]) -> _ExecutionPlan:
+    """获取工作流的执行计划，工作流内容未变化时直接使用缓存"""
+    workflow_id = workflow.get("id")
+    content_hash = _workflow_plan_hash(workflow)
+    cached = _plan_cache.get(workflow_id)
+    if cached is not None and cached[0] == content_hash:
+        return cached[1]
+    
+    plan = _compile_workflow_plan(workflow)
+    if workflow_id:
+        _plan_cache[workflow_id] = (content_hash, plan)
+    return plan
+
+
+def invalidate_workflow_plan(workflow_id: str):
+    """工作流保存或删除后移除缓存的执行计划"""
+    _plan_cache.pop(workflow_id, None)
+
+
+async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """执行完整工作流"""
+    modules = workflow.get("modules", [])
+    workflow_id = workflow.get("id")
+    workflow_name = workflow.get("name", "未命名工作流")
+    
+    # 本次运行的日志共享同一个运行ID，调度器已生成时沿用
+    run_id = get_run_id() or start_run()
+    
+    # 记录工作流开始执行
+    log_workflow_action(workflow_id, "info", f"开始执行工作流: {workflow_name}")
+    
+    # 执行顺序、分支和重复目标只在工作流内容变化后重新计算
+    plan = get_workflow_plan(workflow)
+    
     # 执行工作流
     variables = get_variables()  # 获取全局变量
     workflow_results = {}
@@ -1356,17 +1450,9 @@ async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
     variables["_repeat_times"] = 0
     variables["_repeat_current"] = 0
     
-    # 生成有序模块执行队列
-    ordered_modules = sorted([(module_order[mid], mid) for mid in execution_order])
-    i = 0
-    
-    while i < len(ordered_modules):
-        order, module_id = ordered_modules[i]
-        module = module_map.get(module_id)
-        if not module:
-            i += 1
-            continue
-            
+    for order, module_id, index, module_branch in plan.steps:
+        module = modules[index]
+        
         module_name = module.get("name", "未命名模块")
         module_type = module.get("type")
         
@@ -1401,19 +1487,14 @@ async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
             workflow_results[module_id] = result
             
             # 开始重复执行目标模块
-            target_module_order = module.get("config", {}).get("target_module", "")
             times = int(module.get("config", {}).get("times", 1))
             interval = float(module.get("config", {}).get("interval", 0))
             
-            # 查找目标模块
-            target_module_id = None
-            for mo, mid in ordered_modules:
-                if str(mo) == str(target_module_order):
-                    target_module_id = mid
-                    break
+            # 目标模块在编译执行计划时已查找
+            target_module_id = plan.repeat_targets.get(module_id)
             
             if target_module_id:
-                target_module = module_map.get(target_module_id)
+                target_module = modules[plan.module_index[target_module_id]]
                 
                 # 执行重复操作
                 for t in range(times):
@@ -1438,9 +1519,8 @@ async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
             variables["_repeat_current"] = 0
             
         # 正常模块，在条件分支内时需要检查分支
-        elif isinstance(order, str) and "." in str(order):
+        elif module_branch is not None:
             # 在条件分支内的模块，检查是否是当前活动分支
-            module_branch = order.split(".", 1)[1]
             current_branch = variables.get("_current_branch")
             
             # 只有当前活动分支的模块才会执行
@@ -1473,21 +1553,12 @@ async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
                 error_msg = f"模块 '{module_name}' 执行异常: {str(e)}"
                 log_workflow_action(workflow_id, "error", error_msg)
                 workflow_results[module_id] = {"success": False, "error": error_msg}
-        
-        i += 1
     
     # 保存更新后的变量
     update_variables(variables)
     
-    # 创建模块ID到模块名称的映射
-    module_id_to_name = {}
-    for module_id, module in module_map.items():
-        module_name = module.get("name", "未命名模块")
-        module_type = module.get("type")
-        module_type_info = MODULE_TYPES.get(module_type, {})
-        module_type_name = module_type_info.get("name", module_type)
-        # 保存模块ID到可读名称的映射
-        module_id_to_name[module_id] = f"{module_name} ({module_type_name})"
+    # 模块ID到模块名称的映射，返回副本，调用方的修改不影响缓存的执行计划
+    module_id_to_name = dict(plan.module_names)
     
     # 记录工作流执行完成
     success = all(result.get("success", False) for result in workflow_results.values())
@@ -1513,7 +1584,8 @@ async def execute_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
     return {
         "success": success,
         "results": workflow_results,
-        "module_names": module_id_to_name  # 返回模块名称映射，供上层使用
+        "module_names": module_id_to_name,  # 返回模块名称映射，供上层使用
+        "run_id": run_id
     }
 
 # get_all_module_types函数已移至module_types.py 
\ No newline at end of file
@@ -1,15 +1,40 @@
 import os
+import re
+import copy
 import json
+import hashlib
+import time
 import uuid
 import zlib
 import base64
+import threading
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 from pydantic import BaseModel, Field
 
+from app.utils.config import get_config
+from app.utils.etag import etag_matches
+from app.utils.file_lock import FileLock
+from app.models.workflow_state import (
+    RUN_STATE_FIELDS, get_all_workflow_states, get_workflow_state, get_workflow_states_version, record_last_result
+)
+
 # 工作流存储位置
 WORKFLOWS_FILE = "app/data/workflows.json"
 
+# 按工作流分文件存储时的目录和清单，由配置项workflow_storage选择
+WORKFLOWS_DIR = "app/data/workflows"
+WORKFLOWS_MANIFEST_FILE = os.path.join(WORKFLOWS_DIR, "manifest.json")
+
+# 工作流ID只允许字母、数字、下划线和连字符，分文件存储时ID直接用作文件名
+WORKFLOW_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# 检查工作流文件是否被外部修改的最小间隔（秒），本进程的修改直接更新内存
+WORKFLOWS_MTIME_CHECK_INTERVAL = 1.0
+
+# 多个进程修改工作流时，在文件锁内重新读取再写入
+WORKFLOWS_LOCK_FILE = "app/data/workflows.lock"
+
 class WorkflowModule(BaseModel):
     """工作流模块"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -29,76 +54,314 @@ class Workflow(BaseModel):
     updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     enabled: bool = False
     cron: Optional[str] = None
-    last_run: Optional[str] = None
-    last_result: Optional[str] = None
+
+# 进程内的工作流缓存：按ID索引、保持存储中的顺序，文件修改时间变化时重新加载
+_lock = threading.RLock()
+_workflows: Optional[Dict[str, Dict[str, Any]]] = None
+_storage_mode: Optional[str] = None
+# 单文件模式下为workflows.json的修改时间；分文件模式下为清单和各工作流文件的修改时间
+_mtimes: Dict[str, Optional[int]] = {}
+_last_mtime_check = 0.0
+# 工作流定义的内容哈希：{工作流ID: (缓存中的工作流对象, 哈希)}，缓存中的对象被替换后重新计算
+_hashes: Dict[str, Tuple[Dict[str, Any], str]] = {}
+_file_lock = FileLock(WORKFLOWS_LOCK_FILE)
+
+def _get_storage_mode() -> str:
+    """工作流存储模式：single（workflows.json单文件）或 directory（每个工作流一个文件）"""
+    return "directory" if get_config().get("workflow_storage", "single") == "directory" else "single"
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _atomic_write_json(path: str, data: Any, indent: Optional[int] = 2):
+    """先写临时文件再替换，写入中断不会损坏原文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+def is_valid_workflow_id(workflow_id: Any) -> bool:
+    """工作流ID是否可以安全地用作文件名"""
+    return isinstance(workflow_id, str) and bool(WORKFLOW_ID_PATTERN.match(workflow_id))
+
+def _workflow_path(workflow_id: str) -> str:
+    if not is_valid_workflow_id(workflow_id):
+        raise ValueError(f"无效的工作流ID: {workflow_id!r}")
+    return os.path.join(WORKFLOWS_DIR, f"{workflow_id}.json")
 
 def init_workflows():
-    """初始化工作流存储"""
-    if not os.path.exists(WORKFLOWS_FILE):
-        with open(WORKFLOWS_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+    """初始化工作流存储，并迁移旧版本保存在工作流定义中的运行状态"""
+    _init_storage(_get_storage_mode())
+    _migrate_run_state()
+
+def _init_storage(mode: str):
+    """初始化指定模式的工作流存储，切换存储模式时迁移已有的工作流"""
+    if mode == "directory":
+        if not os.path.exists(WORKFLOWS_MANIFEST_FILE):
+            os.makedirs(WORKFLOWS_DIR, exist_ok=True)
+            workflows = []
+            if os.path.exists(WORKFLOWS_FILE):
+                with open(WORKFLOWS_FILE, 'r', encoding='utf-8') as f:
+                    workflows = json.load(f)
+            invalid = [w for w in workflows if not is_valid_workflow_id(w.get('id'))]
+            for workflow in invalid:
+                print(f"工作流ID无效，未迁移到分文件存储: {workflow.get('id')!r}")
+            workflows = [w for w in workflows if is_valid_workflow_id(w.get('id'))]
+            for workflow in workflows:
+                _atomic_write_json(_workflow_path(workflow['id']), workflow)
+            _atomic_write_json(WORKFLOWS_MANIFEST_FILE, {"workflows": [w['id'] for w in workflows]})
+            if os.path.exists(WORKFLOWS_FILE):
+                os.replace(WORKFLOWS_FILE, WORKFLOWS_FILE + ".bak")
+    elif not os.path.exists(WORKFLOWS_FILE):
+        workflows = []
+        if os.path.exists(WORKFLOWS_MANIFEST_FILE):
+            # 从分文件模式切换回单文件模式
+            workflows = list(_read_workflow_dir().values())
+            os.replace(WORKFLOWS_MANIFEST_FILE, WORKFLOWS_MANIFEST_FILE + ".bak")
+        _atomic_write_json(WORKFLOWS_FILE, workflows)
+
+def _migrate_run_state():
+    """将旧版本保存在工作流定义中的运行状态移入状态存储"""
+    with _lock, _file_lock:
+        workflows = _load_workflows(force=True)
+        for workflow_id, workflow in list(workflows.items()):
+            if not any(field in workflow for field in RUN_STATE_FIELDS):
+                continue
+            if workflow.get('last_run') and not get_workflow_state(workflow_id).get('last_run'):
+                record_last_result(workflow_id, workflow.get('last_result') or "", workflow['last_run'])
+            workflows = dict(workflows)
+            workflows[workflow_id] = {k: v for k, v in workflow.items() if k not in RUN_STATE_FIELDS}
+            _persist(workflows, changed_id=workflow_id)
+
+def _read_manifest() -> List[str]:
+    """读取清单中的工作流ID，忽略不能安全用作文件名的ID"""
+    with open(WORKFLOWS_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+        ids = json.load(f).get("workflows", [])
+    valid = [workflow_id for workflow_id in ids if is_valid_workflow_id(workflow_id)]
+    if len(valid) != len(ids):
+        print(f"工作流清单中有{len(ids) - len(valid)}个无效的ID，已忽略")
+    return valid
+
+def _read_workflow_file(workflow_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_workflow_path(workflow_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        # 单个文件损坏只影响该工作流
+        print(f"读取工作流文件失败 {workflow_id}: {e}")
+        return None
+
+def _read_workflow_dir() -> Dict[str, Dict[str, Any]]:
+    """按清单顺序读取分文件存储的全部工作流"""
+    workflows = {}
+    for workflow_id in _read_manifest():
+        workflow = _read_workflow_file(workflow_id)
+        if workflow is not None:
+            workflows[workflow_id] = workflow
+    return workflows
+
+def _load_workflows(force: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    获取缓存的工作流，调用方需持有_lock
+    
+    每隔WORKFLOWS_MTIME_CHECK_INTERVAL秒检查一次文件修改时间，文件被外部修改时重新读取；
+    分文件模式下只重新读取修改过的工作流文件。修改工作流前在_file_lock内以force=True调用，
+    不受检查间隔限制，基于其他进程的最新修改写入。
+    """
+    global _workflows, _storage_mode, _mtimes, _last_mtime_check
+    now = time.monotonic()
+    if not force and _workflows is not None and now - _last_mtime_check < WORKFLOWS_MTIME_CHECK_INTERVAL:
+        return _workflows
+    _last_mtime_check = now
+    
+    mode = _get_storage_mode()
+    if mode != _storage_mode:
+        with _file_lock:
+            _init_storage(mode)
+        _workflows, _storage_mode, _mtimes = None, mode, {}
+    
+    if mode == "single":
+        mtime = _mtime(WORKFLOWS_FILE)
+        if _workflows is None or mtime != _mtimes.get(WORKFLOWS_FILE):
+            with open(WORKFLOWS_FILE, 'r', encoding='utf-8') as f:
+                workflows = json.load(f)
+            _workflows = {workflow.get('id'): workflow for workflow in workflows}
+            _mtimes = {WORKFLOWS_FILE: mtime}
+        return _workflows
+    
+    manifest_mtime = _mtime(WORKFLOWS_MANIFEST_FILE)
+    ids = _read_manifest() if _workflows is None or manifest_mtime != _mtimes.get(WORKFLOWS_MANIFEST_FILE) \
+        else list(_workflows)
+    current = _workflows or {}
+    workflows = {}
+    mtimes = {WORKFLOWS_MANIFEST_FILE: manifest_mtime}
+    for workflow_id in ids:
+        mtime = _mtime(_workflow_path(workflow_id))
+        if workflow_id in current and mtime == _mtimes.get(workflow_id):
+            workflow = current[workflow_id]
+        else:
+            workflow = _read_workflow_file(workflow_id)
+        if workflow is not None:
+            workflows[workflow_id] = workflow
+            mtimes[workflow_id] = mtime
+    _workflows, _mtimes = workflows, mtimes
+    return _workflows
+
+def _persist(workflows: Dict[str, Dict[str, Any]], changed_id: Optional[str] = None,
+             removed_id: Optional[str] = None):
+    """
+    写入工作流的修改并更新缓存，调用方需持有_lock和_file_lock
+    
+    单文件模式重写workflows.json；分文件模式只写入被修改的工作流文件，增删工作流时再更新清单。
+    """
+    global _workflows
+    if _storage_mode == "directory":
+        os.makedirs(WORKFLOWS_DIR, exist_ok=True)
+        if changed_id is not None:
+            _atomic_write_json(_workflow_path(changed_id), workflows[changed_id])
+            _mtimes[changed_id] = _mtime(_workflow_path(changed_id))
+        if removed_id is not None or (changed_id is not None and changed_id not in _workflows):
+            _atomic_write_json(WORKFLOWS_MANIFEST_FILE, {"workflows": list(workflows)})
+            _mtimes[WORKFLOWS_MANIFEST_FILE] = _mtime(WORKFLOWS_MANIFEST_FILE)
+        if removed_id is not None:
+            try:
+                os.remove(_workflow_path(removed_id))
+            except FileNotFoundError:
+                pass
+            _mtimes.pop(removed_id, None)
+    else:
+        _atomic_write_json(WORKFLOWS_FILE, list(workflows.values()))
+        _mtimes[WORKFLOWS_FILE] = _mtime(WORKFLOWS_FILE)
+    _workflows = workflows
+
+def _with_run_state(workflow: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    """将状态存储中的运行状态合并到工作流副本中"""
+    for field in RUN_STATE_FIELDS:
+        workflow[field] = state.get(field)
+    return workflow
+
+def _content_hash(workflow_id: str, workflow: Dict[str, Any]) -> str:
+    """工作流定义的内容哈希，调用方需持有_lock"""
+    cached = _hashes.get(workflow_id)
+    if cached is not None and cached[0] is workflow:
+        return cached[1]
+    content = json.dumps(workflow, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+    _hashes[workflow_id] = (workflow, digest)
+    return digest
+
+def get_workflow_etag(workflow_id: str) -> Optional[str]:
+    """
+    工作流定义的ETag，只随定义内容变化，用于保存时的If-Match并发检查
+    
+    Returns:
+        带引号的ETag，工作流不存在时返回None
+    """
+    with _lock:
+        workflow = _load_workflows().get(workflow_id)
+        return f'"{_content_hash(workflow_id, workflow)}"' if workflow is not None else None
+
+def get_workflows_etag(workflow_id: Optional[str] = None) -> Optional[str]:
+    """
+    工作流接口响应的ETag，由定义的内容哈希和运行状态存储的版本组成
+    
+    运行状态中包含调度器记录的下次运行时间，定义、运行结果或调度变化时ETag都会改变。
+    
+    Args:
+        workflow_id: 工作流ID，None表示全部工作流的列表
+        
+    Returns:
+        带引号的ETag，指定的工作流不存在时返回None
+    """
+    with _lock:
+        workflows = _load_workflows()
+        if workflow_id is not None:
+            if workflow_id not in workflows:
+                return None
+            parts = [f"{workflow_id}:{_content_hash(workflow_id, workflows[workflow_id])}"]
+        else:
+            parts = [f"{wid}:{_content_hash(wid, workflow)}" for wid, workflow in workflows.items()]
+    parts.append(f"state:{get_workflow_states_version()}")
+    return f'"{hashlib.sha1(",".join(parts).encode("utf-8")).hexdigest()[:16]}"'
 
 def get_all_workflows() -> List[Dict[str, Any]]:
-    """获取所有工作流"""
-    init_workflows()
-    with open(WORKFLOWS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """获取所有工作流，合并了运行状态，返回副本，调用方可以直接修改"""
+    with _lock:
+        workflows = copy.deepcopy(list(_load_workflows().values()))
+    states = get_all_workflow_states()
+    return [_with_run_state(workflow, states.get(workflow.get('id'), {})) for workflow in workflows]
 
 def get_workflow_by_id(workflow_id: str) -> Optional[Dict[str, Any]]:
-    """根据ID获取工作流"""
-    workflows = get_all_workflows()
-    for workflow in workflows:
-        if workflow.get('id') == workflow_id:
-            return workflow
-    return None
-
-def save_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
-    """保存工作流"""
-    workflows = get_all_workflows()
-    
-    # 设置更新时间
-    workflow['updated_at'] = datetime.now().isoformat()
-    
-    # 检查是否存在，进行更新或添加
-    existing_index = None
-    for i, w in enumerate(workflows):
-        if w.get('id') == workflow.get('id'):
-            existing_index = i
-            break
-    
-    if existing_index is not None:
-        workflows[existing_index] = workflow
-    else:
-        # 如果是新工作流，确保有ID和创建时间
-        if 'id' not in workflow or not workflow['id']:
-            workflow['id'] = str(uuid.uuid4())
-        if 'created_at' not in workflow:
-            workflow['created_at'] = datetime.now().isoformat()
-        workflows.append(workflow)
+    """根据ID获取工作流，合并了运行状态，返回副本"""
+    workflow = _get_definition(workflow_id)
+    return _with_run_state(workflow, get_workflow_state(workflow_id)) if workflow is not None else None
+
+def _get_definition(workflow_id: str) -> Optional[Dict[str, Any]]:
+    """获取工作流定义的副本，不含运行状态"""
+    with _lock:
+        workflow = _load_workflows().get(workflow_id)
+        return copy.deepcopy(workflow) if workflow is not None else None
+
+def save_workflow(workflow: Dict[str, Any], if_match: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    保存工作流
     
-    # 保存到文件
-    with open(WORKFLOWS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(workflows, f, ensure_ascii=False, indent=2)
+    Args:
+        workflow: 工作流数据
+        if_match: 编辑开始时工作流的ETag（见get_workflow_etag），指定时只有工作流未被修改过才保存
+        
+    Returns:
+        保存后的工作流，if_match与当前ETag不一致时返回None
+        
+    Raises:
+        ValueError: 新工作流的ID不是字母、数字、下划线和连字符组成
+    """
+    with _lock, _file_lock:
+        workflows = dict(_load_workflows(force=True))
+        
+        # 与强制重新读取的定义比较，检查和写入在同一个文件锁内，其他进程的并发保存不会被覆盖
+        if if_match is not None:
+            current = workflows.get(workflow.get('id') or "")
+            current_etag = f'"{_content_hash(workflow["id"], current)}"' if current is not None else None
+            if not etag_matches(if_match, current_etag):
+                return None
+        
+        # 设置更新时间
+        workflow['updated_at'] = datetime.now().isoformat()
+        
+        # 如果是新工作流，确保有ID和创建时间
+        if workflow.get('id') not in workflows:
+            if 'id' not in workflow or not workflow['id']:
+                workflow['id'] = str(uuid.uuid4())
+            elif not is_valid_workflow_id(workflow['id']):
+                raise ValueError(f"无效的工作流ID: {workflow['id']!r}")
+            if 'created_at' not in workflow:
+                workflow['created_at'] = datetime.now().isoformat()
+        
+        # 缓存中保存副本，调用方之后对workflow的修改不影响缓存；运行状态由状态存储维护，不写入定义
+        workflows[workflow['id']] = {k: copy.deepcopy(v) for k, v in workflow.items() if k not in RUN_STATE_FIELDS}
+        _persist(workflows, changed_id=workflow['id'])
     
     return workflow
 
 def delete_workflow(workflow_id: str) -> bool:
     """删除工作流"""
-    workflows = get_all_workflows()
-    filtered_workflows = [w for w in workflows if w.get('id') != workflow_id]
-    
-    if len(filtered_workflows) == len(workflows):
-        return False  # 没有找到要删除的工作流
+    with _lock, _file_lock:
+        workflows = dict(_load_workflows(force=True))
+        if workflows.pop(workflow_id, None) is None:
+            return False  # 没有找到要删除的工作流
         
-    # 保存到文件
-    with open(WORKFLOWS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(filtered_workflows, f, ensure_ascii=False, indent=2)
+        _persist(workflows, removed_id=workflow_id)
+        _hashes.pop(workflow_id, None)
     
     return True
 
 def update_workflow_status(workflow_id: str, enabled: bool) -> bool:
     """更新工作流启用状态"""
-    workflow = get_workflow_by_id(workflow_id)
+    workflow = _get_definition(workflow_id)
     if not workflow:
         return False
     
@@ -107,14 +370,16 @@ def update_workflow_status(workflow_id: str, enabled: bool) -> bool:
     return True
 
 def update_workflow_result(workflow_id: str, result: str) -> bool:
-    """更新工作流执行结果"""
-    workflow = get_workflow_by_id(workflow_id)
-    if not workflow:
-        return False
+    """
+    更新工作流执行结果
     
-    workflow['last_run'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    workflow['last_result'] = result
-    save_workflow(workflow)
+    结果只写入运行状态存储，工作流定义和updated_at只在用户编辑时改变。
+    """
+    with _lock:
+        if workflow_id not in _load_workflows():
+            return False
+    
+    record_last_result(workflow_id, result)
     return True 
 
 def export_workflow(workflow_id: str) -> Tuple[Optional[bytes], Optional[str]]:
@@ -127,7 +392,8 @@ def export_workflow(workflow_id: str) -> Tuple[Optional[bytes], Optional[str]]:
     Returns:
         Tuple[bytes, str]: 压缩后的工作流数据和文件名，如果工作流不存在则返回(None, None)
     """
-    workflow = get_workflow_by_id(workflow_id)
+    # 只导出工作流定义，不含运行状态
+    workflow = _get_definition(workflow_id)
     if not workflow:
         return None, None
     
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from app.utils.data_dir import get_data_dir
+from app.utils.file_lock import FileLock
+
+# 工作流状态存储位置
+WORKFLOW_STATE_FILE = os.path.join(get_data_dir(), "workflow_state.json")
+
+# 单个工作流的默认状态
+DEFAULT_STATE = {
+    "has_warning": False,  # 是否有未清除的警告
+    "warning_count": 0,  # 未清除的警告日志数量
+    "last_warning_at": None,
+    "warnings_cleared_at": None,  # 警告确认水位线，早于该时间的警告日志视为已清除
+    "last_error": None,  # 最近一次失败的错误信息
+    "last_error_at": None,
+    "consecutive_failures": 0,  # 连续失败次数，成功后归零
+    "last_success_at": None,
+    "last_run": None,  # 最近一次运行结束的时间
+    "last_result": None,  # 最近一次运行的结果
+    "next_run": None,  # 调度器计算的下次运行时间
+}
+
+# 检查状态文件是否被其他进程修改的最小间隔（秒），本进程的修改直接更新内存
+WORKFLOW_STATE_MTIME_CHECK_INTERVAL = 1.0
+
+# 合并到工作流数据中返回的运行状态字段，不写入工作流定义
+RUN_STATE_FIELDS = ("last_run", "last_result", "next_run", "consecutive_failures")
+
+_lock = threading.RLock()
+_states: Optional[Dict[str, Dict[str, Any]]] = None
+_states_mtime: Optional[int] = None
+_last_mtime_check = 0.0
+
+# 多个进程修改状态时，在文件锁内重新读取再写入
+_file_lock = FileLock(WORKFLOW_STATE_FILE + ".lock")
+
+
+def _load(force: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    加载全部工作流状态
+
+    每隔WORKFLOW_STATE_MTIME_CHECK_INTERVAL秒检查一次状态文件的修改时间，未被修改时使用内存中的数据；
+    force为True时不受检查间隔限制并总是重新读取，修改状态前在_file_lock内使用。
+    """
+    global _states, _states_mtime, _last_mtime_check
+    now = time.monotonic()
+    if not force and _states is not None and now - _last_mtime_check < WORKFLOW_STATE_MTIME_CHECK_INTERVAL:
+        return _states
+    _last_mtime_check = now
+    try:
+        mtime = os.stat(WORKFLOW_STATE_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if force or _states is None or mtime != _states_mtime:
+        try:
+            with open(WORKFLOW_STATE_FILE, "r", encoding="utf-8") as f:
+                _states = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _states = {}
+        _states_mtime = mtime
+    return _states
+
+
+def _save():
+    """原子写入状态文件"""
+    global _states_mtime
+    os.makedirs(os.path.dirname(WORKFLOW_STATE_FILE), exist_ok=True)
+    tmp_path = f"{WORKFLOW_STATE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(_states, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, WORKFLOW_STATE_FILE)
+    _states_mtime = os.stat(WORKFLOW_STATE_FILE).st_mtime_ns
+
+
+def _state(workflow_id: str) -> Dict[str, Any]:
+    states = _load()
+    if workflow_id not in states:
+        states[workflow_id] = dict(DEFAULT_STATE)
+    return states[workflow_id]
+
+
+def workflow_states_initialized() -> bool:
+    """状态文件是否已经存在"""
+    return os.path.exists(WORKFLOW_STATE_FILE)
+
+
+def get_workflow_state(workflow_id: str) -> Dict[str, Any]:
+    """获取工作流状态"""
+    with _lock:
+        return {**DEFAULT_STATE, **_load().get(workflow_id, {})}
+
+
+def get_workflow_states_version() -> int:
+    """状态存储的版本，任何工作流的状态变化后改变，用于生成ETag"""
+    with _lock:
+        _load()
+        return _states_mtime or 0
+
+
+def get_all_workflow_states() -> Dict[str, Dict[str, Any]]:
+    """获取所有工作流的状态，键为工作流ID"""
+    with _lock:
+        return {workflow_id: {**DEFAULT_STATE, **state} for workflow_id, state in _load().items()}
+
+
+def record_warnings(warnings: Dict[str, List[str]]):
+    """
+    记录新写入的警告日志，时间不晚于确认水位线的警告不再计入
+
+    Args:
+        warnings: 工作流ID到其警告日志时间列表的映射，按写入顺序排列
+    """
+    with _lock, _file_lock:
+        _load(force=True)
+        changed = False
+        for workflow_id, timestamps in warnings.items():
+            cleared_at = _load().get(workflow_id, {}).get("warnings_cleared_at")
+            if cleared_at:
+                timestamps = [ts for ts in timestamps if ts and ts > cleared_at]
+            if not timestamps:
+                continue
+            state = _state(workflow_id)
+            state["has_warning"] = True
+            state["warning_count"] = state.get("warning_count", 0) + len(timestamps)
+            state["last_warning_at"] = timestamps[-1]
+            changed = True
+        if changed:
+            _save()
+
+
+def record_run_result(workflow_id: str, success: bool, error: Optional[str] = None):
+    """
+    记录一次工作流运行的结果
+
+    Args:
+        workflow_id: 工作流ID
+        success: 是否执行成功
+        error: 失败时的错误信息
+    """
+    now = datetime.now().isoformat()
+    with _lock, _file_lock:
+        _load(force=True)
+        state = _state(workflow_id)
+        if success:
+            state["consecutive_failures"] = 0
+            state["last_success_at"] = now
+        else:
+            state["consecutive_failures"] = state.get("consecutive_failures", 0) + 1
+            state["last_error"] = error
+            state["last_error_at"] = now
+        _save()
+
+
+def record_last_result(workflow_id: str, result: str, last_run: Optional[str] = None):
+    """
+    记录工作流最近一次运行的时间和结果
+
+    Args:
+        workflow_id: 工作流ID
+        result: 运行结果
+        last_run: 运行时间，默认为当前时间
+    """
+    with _lock, _file_lock:
+        _load(force=True)
+        state = _state(workflow_id)
+        state["last_run"] = last_run or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        state["last_result"] = result
+        _save()
+
+
+def record_next_run(workflow_id: str, next_run: Optional[str]):
+    """记录调度器计算的下次运行时间，None表示未设置调度，值未变化时不写入"""
+    with _lock:
+        state = _load().get(workflow_id)
+        if (state or {}).get("next_run") == next_run:
+            return
+        with _file_lock:
+            _load(force=True)
+            _state(workflow_id)["next_run"] = next_run
+            _save()
+
+
+def reset_workflow_warnings(workflow_id: str, cleared_at: Optional[str] = None) -> int:
+    """
+    清除工作流的警告状态，并把确认水位线推进到指定时间
+
+    警告日志本身保留，仍可用于历史分析；水位线之前的警告即使稍后才写入也不会重新标记。
+
+    Args:
+        workflow_id: 工作流ID
+        cleared_at: 确认时间，默认为当前时间
+
+    Returns:
+        清除前未清除的警告数量
+    """
+    with _lock, _file_lock:
+        _load(force=True)
+        state = _state(workflow_id)
+        count = state.get("warning_count", 0)
+        state["has_warning"] = False
+        state["warning_count"] = 0
+        state["warnings_cleared_at"] = cleared_at or datetime.now().isoformat()
+        _save()
+        return count
+
+
+def remove_workflow_state(workflow_id: str):
+    """删除工作流时移除其状态"""
+    with _lock, _file_lock:
+        _load(force=True)
+        if _load().pop(workflow_id, None) is not None:
+            _save()
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Request, Depends, Form, HTTPException, status, Query, File, UploadFile
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from typing import Optional, Dict, Any, List
 import json
+import zlib
 import smtplib
 import httpx
 from email.header import Header
@@ -14,11 +15,13 @@ from datetime import datetime
 import ssl
 
 from app.routes.auth import get_current_user
-from app.models.workflow import get_all_workflows, get_workflow_by_id, save_workflow, delete_workflow, update_workflow_status, export_workflow, import_workflow
+from app.models.workflow import get_all_workflows, get_workflow_by_id, get_workflow_etag, save_workflow, delete_workflow, update_workflow_status, export_workflow, import_workflow
 from app.models.module_types import get_all_module_types
+from app.models.modules import invalidate_workflow_plan
 from app.utils.config import get_config, update_config, get_account_config, update_account_config
 from app.utils.scheduler import add_workflow_job, remove_workflow_job, get_next_run_time, manual_run_workflow
-from app.models.log import get_logs, clear_logs, log_system_action
+from app.models.log import get_logs, get_logs_page, encode_log_cursor, clear_logs, log_system_action, get_log_buffer_stats, get_log_details, get_run_logs, search_logs, subscribe_logs, unsubscribe_logs, get_log_stats, iter_logs
+from app.models.workflow_state import get_all_workflow_states, remove_workflow_state
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 templates = Jinja2Templates(directory="app/templates")
@@ -27,24 +30,17 @@ templates = Jinja2Templates(directory="app/templates")
 async def dashboard(request: Request, user: str = Depends(get_current_user)):
     """管理仪表盘页面"""
     workflows = get_all_workflows()
+    # 工作流的警告状态在运行时维护，一次读取全部
+    states = get_all_workflow_states()
     # 添加下次运行时间
     for workflow in workflows:
         workflow["next_run"] = get_next_run_time(workflow.get("id", ""))
         
-        # 检查是否有警告日志，如有则添加警告标记
-        has_warning = False
-        # 获取最近的工作流日志
-        logs, _ = get_logs(
-            log_type="workflow", 
-            workflow_id=workflow.get("id"), 
-            log_level="WARNING", 
-            page=1, 
-            page_size=1
-        )
-        if logs and len(logs) > 0:
-            has_warning = True
-        
-        workflow["has_warning"] = has_warning
+        # 添加警告标记和最近的失败信息
+        state = states.get(workflow.get("id"), {})
+        workflow["has_warning"] = state.get("has_warning", False)
+        workflow["last_error"] = state.get("last_error")
+        workflow["consecutive_failures"] = state.get("consecutive_failures", 0)
     
     return templates.TemplateResponse(
         "admin/dashboard.html", 
@@ -61,6 +57,7 @@ async def new_workflow_page(request: Request, user: str = Depends(get_current_us
         {
             "request": request, 
             "workflow": {"id": "", "name": "", "description": "", "modules": [], "connections": []},
+            "workflow_etag": None,
             "module_types": module_types,
             "is_new": True
         }
@@ -80,6 +77,7 @@ async def edit_workflow_page(workflow_id: str, request: Request, user: str = Dep
         {
             "request": request, 
             "workflow": workflow,
+            "workflow_etag": get_workflow_etag(workflow_id),
             "module_types": module_types,
             "is_new": False
         }
@@ -97,8 +95,22 @@ async def save_workflow_api(request: Request, user: str = Depends(get_current_us
             content={"success": False, "message": "工作流名称不能为空"}
         )
     
-    # 保存工作流
-    saved_workflow = save_workflow(workflow)
+    # 保存工作流，带If-Match时只有工作流在编辑期间未被修改才保存
+    try:
+        saved_workflow = save_workflow(workflow, if_match=request.headers.get("if-match"))
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"success": False, "message": str(e)}
+        )
+    if saved_workflow is None:
+        return JSONResponse(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            content={"success": False, "message": "工作流已被其他人修改或删除，请刷新页面后重新编辑"}
+        )
+    
+    # 工作流内容可能已变化，下次运行时重新编译执行计划
+    invalidate_workflow_plan(saved_workflow.get("id"))
     
     # 设置定时任务
     if workflow.get("enabled") and workflow.get("cron"):
@@ -110,7 +122,8 @@ async def save_workflow_api(request: Request, user: str = Depends(get_current_us
     log_system_action("info", f"保存工作流: {workflow.get('name')}", {"workflow_id": saved_workflow.get("id")})
     
     return JSONResponse(
-        content={"success": True, "message": "工作流保存成功", "workflow": saved_workflow}
+        content={"success": True, "message": "工作流保存成功", "workflow": saved_workflow},
+        headers={"ETag": get_workflow_etag(saved_workflow["id"])}
     )
 
 @router.post("/workflow/{workflow_id}/toggle")
@@ -160,6 +173,8 @@ async def delete_workflow_api(workflow_id: str, user: str = Depends(get_current_
     # 删除调度任务
     if result:
         remove_workflow_job(workflow_id)
+        remove_workflow_state(workflow_id)
+        invalidate_workflow_plan(workflow_id)
         # 记录日志
         log_system_action("info", f"删除工作流: {workflow_name}", {"workflow_id": workflow_id})
     
@@ -455,19 +470,35 @@ async def logs_page(
     level: Optional[str] = Query(None, description="日志级别: debug, info, warning, error"),
     page: int = Query(1, description="页码", ge=1),
     page_size: int = Query(50, description="每页数量", ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="分页游标，由上一页的下一页链接提供"),
 ):
     """日志页面"""
     # 获取所有工作流，用于在UI中展示
     workflows = get_all_workflows()
     
-    # 获取日志
-    logs, total = get_logs(
-        log_type=type,
-        workflow_id=workflow_id,
-        log_level=level,
-        page=page,
-        page_size=page_size
-    )
+    # 获取日志：下一页链接带有游标，按游标定位；直接指定页码时（如上一页）按页码读取
+    logs, next_cursor = None, None
+    if cursor or page == 1:
+        try:
+            logs, next_cursor, total = get_logs_page(
+                log_type=type,
+                workflow_id=workflow_id,
+                log_level=level,
+                cursor=cursor,
+                page_size=page_size
+            )
+        except ValueError:
+            logs = None
+    if logs is None:
+        logs, total = get_logs(
+            log_type=type,
+            workflow_id=workflow_id,
+            log_level=level,
+            page=page,
+            page_size=page_size
+        )
+        if logs and page * page_size < total:
+            next_cursor = encode_log_cursor(logs[-1])
     
     return templates.TemplateResponse(
         "admin/logs.html", 
@@ -480,10 +511,70 @@ async def logs_page(
             "level": level,
             "page": page,
             "page_size": page_size,
-            "total": total
+            "total": total,
+            "next_cursor": next_cursor
         }
     )
 
+@router.get("/logs/data")
+async def logs_data(
+    user: str = Depends(get_current_user),
+    type: str = Query("system", description="日志类型: system 或 workflow"),
+    workflow_id: Optional[str] = Query(None, description="工作流ID，仅当type=workflow时有效"),
+    level: Optional[str] = Query(None, description="日志级别: debug, info, warning, error"),
+    cursor: Optional[str] = Query(None, description="分页游标，使用上一页返回的next_cursor"),
+    page_size: int = Query(50, description="每页数量", ge=1, le=500),
+    q: Optional[str] = Query(None, description="全文检索文本，指定后按相关度返回命中结果"),
+    page: int = Query(1, description="检索结果页码", ge=1),
+    start_time: Optional[str] = Query(None, description="起始时间（含，ISO格式）"),
+    end_time: Optional[str] = Query(None, description="结束时间（不含，ISO格式）"),
+):
+    """日志数据接口，按游标分页；指定q时返回全文检索结果，指定时间范围时按页码分页"""
+    if q and q.strip():
+        hits, total = search_logs(
+            query=q,
+            log_type=type,
+            workflow_id=workflow_id,
+            log_level=level,
+            page=page,
+            page_size=page_size
+        )
+        return JSONResponse(
+            content={"logs": hits, "total": total, "page": page, "page_size": page_size}
+        )
+    
+    if start_time or end_time:
+        logs, total = get_logs(
+            log_type=type,
+            workflow_id=workflow_id,
+            log_level=level,
+            page=page,
+            page_size=page_size,
+            start_time=start_time,
+            end_time=end_time
+        )
+        return JSONResponse(
+            content={"logs": logs, "total": total, "page": page, "page_size": page_size}
+        )
+    
+    try:
+        logs, next_cursor, total = get_logs_page(
+            log_type=type,
+            workflow_id=workflow_id,
+            log_level=level,
+            cursor=cursor,
+            page_size=page_size
+        )
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": str(e)}
+        )
+    
+    return JSONResponse(
+        content={"logs": logs, "next_cursor": next_cursor, "total": total}
+    )
+
 @router.post("/logs/clear")
 async def clear_logs_api(
     request: Request, 
@@ -507,6 +598,121 @@ async def clear_logs_api(
         content={"success": True, "message": f"已清空{count}条日志"}
     )
 
+@router.get("/logs/stream")
+async def logs_stream(
+    request: Request,
+    user: str = Depends(get_current_user),
+    type: str = Query("system", description="日志类型: system 或 workflow"),
+    workflow_id: Optional[str] = Query(None, description="工作流ID，仅当type=workflow时有效"),
+    level: Optional[str] = Query(None, description="日志级别: debug, info, warning, error"),
+    run_id: Optional[str] = Query(None, description="运行ID"),
+):
+    """实时推送新日志（Server-Sent Events）"""
+    subscription = subscribe_logs(log_type=type, workflow_id=workflow_id, log_level=level, run_id=run_id)
+    
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                entry = await subscription.get(timeout=15)
+                if entry is None:
+                    # 定期发送注释行保持连接
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {entry.get('id')}\ndata: {json.dumps(entry, ensure_ascii=False, default=str)}\n\n"
+        finally:
+            unsubscribe_logs(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/logs/export")
+async def export_logs(
+    user: str = Depends(get_current_user),
+    type: str = Query("system", description="日志类型: system, workflow 或 all"),
+    workflow_id: Optional[str] = Query(None, description="工作流ID"),
+    level: Optional[str] = Query(None, description="日志级别: debug, info, warning, error"),
+    start_time: Optional[str] = Query(None, description="起始时间（含，ISO格式）"),
+    end_time: Optional[str] = Query(None, description="结束时间（不含，ISO格式）"),
+    format: str = Query("ndjson", description="导出格式: ndjson 或 gzip", pattern="^(ndjson|gzip)$"),
+):
+    """导出日志，每行一条JSON，按时间倒序逐条输出，可选gzip压缩"""
+    logs = iter_logs(
+        log_type=type,
+        workflow_id=workflow_id,
+        log_level=level,
+        start_time=start_time,
+        end_time=end_time
+    )
+    
+    def ndjson_lines():
+        for entry in logs:
+            yield (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    
+    def gzip_chunks():
+        # wbits=31 输出gzip格式，压缩数据累积到一定大小再输出
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        pending = []
+        size = 0
+        for line in ndjson_lines():
+            data = compressor.compress(line)
+            if data:
+                pending.append(data)
+                size += len(data)
+            if size >= 64 * 1024:
+                yield b"".join(pending)
+                pending, size = [], 0
+        pending.append(compressor.flush())
+        yield b"".join(pending)
+    
+    filename = f"logs_{type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    if format == "gzip":
+        return StreamingResponse(
+            gzip_chunks(),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f"attachment; filename={filename}.gz"}
+        )
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@router.get("/logs/runs/{run_id}")
+async def run_logs(run_id: str, user: str = Depends(get_current_user)):
+    """获取一次工作流运行的全部日志"""
+    logs = get_run_logs(run_id)
+    return JSONResponse(
+        content={"run_id": run_id, "logs": logs, "total": len(logs)}
+    )
+
+@router.get("/logs/details/{details_ref}")
+async def log_details(details_ref: str, user: str = Depends(get_current_user)):
+    """获取单独保存的日志详情，展开日志时按需加载"""
+    details = get_log_details(details_ref)
+    if details is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "日志详情不存在"}
+        )
+    return JSONResponse(content=details)
+
+@router.get("/logs/stats")
+async def log_stats(
+    user: str = Depends(get_current_user),
+    workflow_id: Optional[str] = Query(None, description="工作流ID，指定时只统计该工作流"),
+    days: int = Query(7, description="按天统计的天数", ge=1, le=90),
+):
+    """日志统计：按级别、工作流、小时和天的日志数量"""
+    return JSONResponse(content=get_log_stats(workflow_id=workflow_id, days=days))
+
+@router.get("/logs/buffer")
+async def log_buffer_stats(user: str = Depends(get_current_user)):
+    """日志缓冲区状态：队列深度和刷新耗时"""
+    return JSONResponse(content=get_log_buffer_stats())
+
 @router.get("/modules", response_class=HTMLResponse)
 async def modules_page(request: Request, user: str = Depends(get_current_user)):
     """模块管理页面"""
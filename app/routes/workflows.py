@@ -1,30 +1,39 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from typing import Dict, Any, List, Optional
 import json
 
 from app.routes.auth import get_current_user
-from app.models.workflow import get_all_workflows, get_workflow_by_id, update_workflow_result
+from app.models.workflow import get_all_workflows, get_workflow_by_id, get_workflows_etag, update_workflow_result
 from app.models.modules import execute_workflow
 from app.utils.scheduler import get_next_run_time, manual_run_workflow
 from app.models.log import log_workflow_action
+from app.utils.etag import etag_matches
 
 router = APIRouter(prefix="/api/workflows", tags=["workflows"])
 
 @router.get("/")
-async def list_workflows(user: str = Depends(get_current_user)) -> List[Dict[str, Any]]:
-    """获取所有工作流列表"""
+async def list_workflows(request: Request, user: str = Depends(get_current_user)) -> List[Dict[str, Any]]:
+    """获取所有工作流列表，支持If-None-Match条件请求"""
+    etag = get_workflows_etag()
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
     workflows = get_all_workflows()
     
     # 添加下次运行时间
     for workflow in workflows:
         workflow["next_run"] = get_next_run_time(workflow.get("id", ""))
     
-    return workflows
+    return JSONResponse(content=workflows, headers={"ETag": etag})
 
 @router.get("/{workflow_id}")
-async def get_workflow(workflow_id: str, user: str = Depends(get_current_user)) -> Dict[str, Any]:
-    """获取指定ID的工作流"""
+async def get_workflow(workflow_id: str, request: Request, user: str = Depends(get_current_user)) -> Dict[str, Any]:
+    """获取指定ID的工作流，支持If-None-Match条件请求"""
+    etag = get_workflows_etag(workflow_id)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
     workflow = get_workflow_by_id(workflow_id)
     
     if not workflow:
@@ -33,7 +42,7 @@ async def get_workflow(workflow_id: str, user: str = Depends(get_current_user))
     # 添加下次运行时间
     workflow["next_run"] = get_next_run_time(workflow.get("id", ""))
     
-    return workflow
+    return JSONResponse(content=workflow, headers={"ETag": etag})
 
 @router.post("/{workflow_id}/run")
 async def run_workflow(workflow_id: str, user: str = Depends(get_current_user)):
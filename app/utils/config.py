@@ -13,7 +13,22 @@ ACCOUNT_CONFIG_FILE = "app/data/account_config.json"
 DEFAULT_CONFIG = {
     "admin_password": "admin",
     "log_level": "INFO",  # 新增日志级别，可选：DEBUG, INFO, WARNING, ERROR
-    "log_max_entries": 10000,  # 每种类型日志保留的最大条数
+    "log_max_entries": 10000,  # 系统日志保留的最大条数，工作流日志见log_retention
+    "log_backend": "file",  # 日志存储后端，可选：file（分段文件）, sqlite
+    "workflow_storage": "single",  # 工作流存储方式，可选：single（workflows.json单文件）, directory（每个工作流一个文件）
+    "log_retention": {
+        "max_age_days": 0,  # 日志最长保留天数，0表示不限制
+        "max_bytes": 0,  # 每种类型日志占用的最大字节数，0表示不限制
+        "max_entries_per_workflow": 2000,  # 每个工作流最多保留的日志条数
+        "archive_after_days": 7,  # 超过该天数的日志移入按天压缩的归档，0表示不归档
+        "compaction_interval": 60  # 后台日志压缩间隔（分钟）
+    },
+    "log_sampling": {
+        "enabled": True,  # 是否抑制短时间内大量重复的日志，警告和错误日志从不抑制
+        "window_seconds": 60,  # 统计重复的时间窗口（秒）
+        "burst": 10,  # 每个窗口内相同日志完整记录的条数，其余的汇总为一条
+        "sample_every": 100  # 超出后每隔多少条仍记录一条作为采样，0表示不采样
+    },
     "email": {
         "smtp_server": "",
         "smtp_port": 465,
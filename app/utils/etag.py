@@ -0,0 +1,27 @@
+from typing import Optional
+
+
+def etag_matches(header: Optional[str], etag: Optional[str]) -> bool:
+    """
+    判断If-None-Match或If-Match请求头是否与ETag匹配
+
+    请求头可以包含逗号分隔的多个ETag或"*"，比较时忽略弱校验前缀W/。
+
+    Args:
+        header: 请求头的值
+        etag: 当前资源的ETag，资源不存在时为None
+
+    Returns:
+        匹配时返回True
+    """
+    if not header or etag is None:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -7,8 +7,10 @@ import threading
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from app.models.workflow import get_all_workflows, get_workflow_by_id, update_workflow_result
+from app.models.workflow_state import record_run_result, record_next_run
 from app.models.modules import execute_workflow
-from app.models.log import log_system_action, log_workflow_action, clear_workflow_warnings
+from app.models.log import log_system_action, log_workflow_action, clear_workflow_warnings, compact_logs, start_run
+from app.utils.config import get_config
 import uuid
 
 # 设置日志
@@ -37,6 +39,22 @@ def init_scheduler():
         for workflow in workflows:
             if workflow.get("enabled", False) and workflow.get("cron"):
                 add_workflow_job(workflow)
+        
+        # 定期在后台按保留策略压缩日志
+        add_log_compaction_job()
+
+def add_log_compaction_job():
+    """添加日志压缩任务，间隔由log_retention.compaction_interval配置（分钟）"""
+    retention = get_config().get("log_retention") or {}
+    interval = max(int(retention.get("compaction_interval", 60) or 60), 1)
+    scheduler.add_job(
+        compact_logs,
+        'interval',
+        minutes=interval,
+        next_run_time=datetime.now() + timedelta(minutes=1),
+        id="log_compaction",
+        replace_existing=True
+    )
 
 def add_workflow_job(workflow: Dict[str, Any]):
     """添加工作流调度任务"""
@@ -74,6 +92,7 @@ def add_workflow_job(workflow: Dict[str, Any]):
         )
         
         # 验证任务是否成功添加
+        _record_next_run(workflow_id)
         if job and job.next_run_time:
             next_run = job.next_run_time.strftime("%Y-%m-%d %H:%M:%S")
             logger.info(f"已为工作流 '{workflow.get('name')}' (ID: {workflow_id}) 添加调度: {cron_expr}, 下次运行时间: {next_run}")
@@ -93,15 +112,29 @@ def remove_workflow_job(workflow_id: str):
     
     try:
         scheduler.remove_job(str(workflow_id))
+        record_next_run(workflow_id, None)
         logger.info(f"已移除工作流ID: {workflow_id}的调度")
     except Exception as e:
         # 工作可能不存在，忽略错误
         pass
 
+def _record_next_run(workflow_id: str):
+    """将调度任务的下次运行时间写入运行状态存储"""
+    try:
+        job = scheduler.get_job(str(workflow_id))
+        next_run = job.next_run_time.strftime("%Y-%m-%d %H:%M:%S") if job and job.next_run_time else None
+        record_next_run(workflow_id, next_run)
+    except Exception as e:
+        logger.warning(f"记录工作流下次运行时间失败: {str(e)}")
+
 def run_workflow(workflow_id: str):
     """运行工作流"""
     logger.info(f"开始执行工作流 ID: {workflow_id}")
     
+    # 调度器触发任务前已计算出下次运行时间
+    if scheduler is not None:
+        _record_next_run(workflow_id)
+    
     try:
         workflow = get_workflow_by_id(workflow_id)
         if not workflow:
@@ -123,6 +156,9 @@ def run_async_workflow(workflow: Dict[str, Any]):
     workflow_id = workflow.get("id", "unknown")
     workflow_name = workflow.get("name", "未命名工作流")
     
+    # 每次运行在独立线程中，生成本次运行的ID
+    start_run()
+    
     try:
         # 创建事件循环
         loop = asyncio.new_event_loop()
@@ -138,6 +174,7 @@ def run_async_workflow(workflow: Dict[str, Any]):
         success = result.get("success", False)
         if success:
             update_workflow_result(workflow_id, "执行成功")
+            record_run_result(workflow_id, True)
             log_workflow_action(workflow_id, "info", f"工作流 '{workflow_name}' 执行成功", result)
             
             # 成功后清除工作流的警告状态
@@ -146,6 +183,7 @@ def run_async_workflow(workflow: Dict[str, Any]):
         else:
             error_msg = result.get("error", "未知错误")
             update_workflow_result(workflow_id, f"执行失败: {error_msg}")
+            record_run_result(workflow_id, False, f"执行失败: {error_msg}")
             log_workflow_action(workflow_id, "warning", f"工作流 '{workflow_name}' 执行失败: {error_msg}", result)
             
             # 检查是否需要重试
@@ -175,6 +213,7 @@ def run_async_workflow(workflow: Dict[str, Any]):
         # 即使出错也更新最后运行时间
         try:
             update_workflow_result(workflow.get("id"), f"执行出错: {str(e)}")
+            record_run_result(workflow.get("id"), False, f"执行出错: {str(e)}")
             
             # 检查是否需要重试
             retry_count = workflow.get("retry_count", 0)
@@ -226,6 +265,7 @@ async def execute_workflow_job(workflow_id: str):
         return
     
     workflow_name = workflow.get("name", "未知工作流")
+    start_run()
     
     # 记录开始执行
     log_workflow_action(workflow_id, "info", f"开始执行工作流: {workflow_name}")
@@ -238,6 +278,7 @@ async def execute_workflow_job(workflow_id: str):
         success = result.get("success", False)
         if success:
             update_workflow_result(workflow_id, "执行成功")
+            record_run_result(workflow_id, True)
             log_workflow_action(workflow_id, "info", f"工作流 '{workflow_name}' 执行成功", result)
             
             # 成功后清除工作流的警告状态
@@ -245,6 +286,7 @@ async def execute_workflow_job(workflow_id: str):
             log_workflow_action(workflow_id, "info", f"工作流执行成功，已清除警告状态")
         else:
             update_workflow_result(workflow_id, f"执行失败: {result.get('error', '未知错误')}")
+            record_run_result(workflow_id, False, f"执行失败: {result.get('error', '未知错误')}")
             log_workflow_action(workflow_id, "warning", f"工作流 '{workflow_name}' 执行失败", result)
             
             # 检查是否需要重试
@@ -266,6 +308,7 @@ async def execute_workflow_job(workflow_id: str):
     except Exception as e:
         # 记录执行异常
         update_workflow_result(workflow_id, f"执行异常: {str(e)}")
+        record_run_result(workflow_id, False, f"执行异常: {str(e)}")
         log_workflow_action(workflow_id, "error", f"工作流 '{workflow_name}' 执行异常", {"error": str(e)})
         
         # 检查是否需要重试
@@ -297,6 +340,7 @@ async def retry_workflow_job(workflow_id: str, remaining_retries: int):
         return
     
     workflow_name = workflow.get("name", "未知工作流")
+    start_run()
     
     # 记录重试执行
     log_workflow_action(workflow_id, "info", f"重试执行工作流: {workflow_name}, 剩余重试次数: {remaining_retries-1}")
@@ -309,6 +353,7 @@ async def retry_workflow_job(workflow_id: str, remaining_retries: int):
         success = result.get("success", False)
         if success:
             update_workflow_result(workflow_id, "执行成功")
+            record_run_result(workflow_id, True)
             log_workflow_action(workflow_id, "info", f"工作流 '{workflow_name}' 重试执行成功", result)
             
             # 成功后清除工作流的警告状态 - 通过删除所有WARNING级别的日志
@@ -316,6 +361,7 @@ async def retry_workflow_job(workflow_id: str, remaining_retries: int):
             log_workflow_action(workflow_id, "info", f"工作流 '{workflow_name}' 重试成功，已清除警告状态")
         else:
             update_workflow_result(workflow_id, f"执行失败: {result.get('error', '未知错误')}")
+            record_run_result(workflow_id, False, f"执行失败: {result.get('error', '未知错误')}")
             log_workflow_action(workflow_id, "warning", f"工作流 '{workflow_name}' 重试执行失败", result)
             
             # 检查是否还有重试次数
@@ -338,6 +384,7 @@ async def retry_workflow_job(workflow_id: str, remaining_retries: int):
     except Exception as e:
         # 记录执行异常
         update_workflow_result(workflow_id, f"执行异常: {str(e)}")
+        record_run_result(workflow_id, False, f"执行异常: {str(e)}")
         log_workflow_action(workflow_id, "error", f"工作流 '{workflow_name}' 重试执行异常", {"error": str(e)})
         
         # 检查是否还有重试次数
@@ -15,7 +15,7 @@ from app.routes import admin, workflows, auth
 from app.models.workflow import init_workflows
 from app.utils.scheduler import init_scheduler
 from app.utils.config import get_log_level, ensure_config_exists
-from app.models.log import setup_logging, log_system_action, migrate_old_logs
+from app.models.log import setup_logging, log_system_action, migrate_old_logs, shutdown_logging
 
 # 创建应用
 app = FastAPI(
@@ -113,6 +113,12 @@ async def startup_event():
         log_system_action("error", f"启动失败: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时执行的任务"""
+    # 写入缓冲区中尚未落盘的日志
+    shutdown_logging()
+
 def main():
     """应用程序主入口"""
     try:
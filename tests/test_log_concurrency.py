@@ -0,0 +1,142 @@
+import os
+import multiprocessing
+import threading
+
+import pytest
+
+from app.models.log_store import SegmentLogStore
+from app.models.log_sqlite import SQLiteLogStore
+
+PROCESSES = 4
+THREADS = 4
+BATCHES = 30
+BATCH_SIZE = 10
+SOURCES = ["wf-a", "wf-b", "wf-c"]
+LEVELS = ["info", "warning"]
+
+# 经由add_log写入时每个线程的日志数量
+LOGS_PER_THREAD = 150
+
+
+def _open_store(path: str, backend: str):
+    if backend == "sqlite":
+        return SQLiteLogStore(path, "workflow_logs")
+    return SegmentLogStore(path, segment_max_bytes=16 * 1024, index_sources=True)
+
+
+def _append_worker(path: str, backend: str, worker: int):
+    """一个进程：多个线程共用一个存储实例并发追加"""
+    store = _open_store(path, backend)
+
+    def run(thread: int):
+        for batch in range(BATCHES):
+            entries = []
+            for i in range(BATCH_SIZE):
+                n = batch * BATCH_SIZE + i
+                entries.append({
+                    "id": f"{worker}-{thread}-{batch}-{i}",
+                    "timestamp": f"2026-01-01T00:00:{n % 60:02d}",
+                    "level": LEVELS[n % len(LEVELS)],
+                    "source": SOURCES[n % len(SOURCES)],
+                    "message": "x" * (n % 50),
+                })
+            store.append_many(entries)
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def _add_log_worker(data_dir: str, worker: int):
+    """一个进程：多个线程经由add_log写入，由日志缓冲区的后台线程批量写入存储"""
+    # 日志模块按当前目录下的app/data定位数据，需在导入前切换目录
+    os.chdir(data_dir)
+    from app.models import log
+    log._configure_log_sampler()
+
+    def run(thread: int):
+        for i in range(LOGS_PER_THREAD):
+            source = "system" if i % 4 == 0 else SOURCES[i % len(SOURCES)]
+            log.add_log(LEVELS[i % len(LEVELS)], source, f"worker {worker} thread {thread} log {i}")
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    log.flush_logs()
+
+
+def _run_processes(target, args_list):
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=target, args=args) for args in args_list]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(timeout=120)
+        assert p.exitcode == 0
+
+
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+def test_concurrent_appends_lose_no_records(tmp_path, backend):
+    path = str(tmp_path / ("logs.db" if backend == "sqlite" else "workflow"))
+    _run_processes(_append_worker, [(path, backend, w) for w in range(PROCESSES)])
+
+    expected = PROCESSES * THREADS * BATCHES * BATCH_SIZE
+    store = _open_store(path, backend)
+
+    # 每条日志都完整且只出现一次
+    entries = list(store.iter_entries())
+    ids = [entry["id"] for entry in entries]
+    assert len(ids) == expected
+    assert len(set(ids)) == expected
+    assert store.count() == expected
+
+    if backend == "file":
+        # 全量索引与分段一一对应，不需要重建
+        assert store._index_consistent()
+    logs, total = store.query(None, None, 0, expected)
+    assert total == expected
+    assert sorted(entry["id"] for entry in logs) == sorted(ids)
+
+    # 按来源和级别的查询与日志内容一致
+    for source in SOURCES:
+        for level in [None] + LEVELS:
+            matching = [e for e in entries if e["source"] == source and (level is None or e["level"] == level)]
+            logs, total = store.query(source, level, 0, expected)
+            assert total == len(matching)
+            assert sorted(entry["id"] for entry in logs) == sorted(e["id"] for e in matching)
+
+
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+def test_concurrent_add_log_loses_no_records(tmp_path, backend):
+    data_dir = tmp_path / "app" / "data"
+    data_dir.mkdir(parents=True)
+    # 关闭重复日志抑制，每条日志都应写入
+    (data_dir / "config.yaml").write_text(
+        f"log_backend: {backend}\nlog_sampling:\n  enabled: false\n", encoding="utf-8"
+    )
+    _run_processes(_add_log_worker, [(str(tmp_path), w) for w in range(PROCESSES)])
+
+    per_thread = {"system": 0, **{source: 0 for source in SOURCES}}
+    for i in range(LOGS_PER_THREAD):
+        per_thread["system" if i % 4 == 0 else SOURCES[i % len(SOURCES)]] += 1
+    expected = {source: n * PROCESSES * THREADS for source, n in per_thread.items()}
+
+    log_dir = data_dir / "logs"
+    if backend == "sqlite":
+        system = SQLiteLogStore(str(log_dir / "logs.db"), "system_logs")
+        workflow = SQLiteLogStore(str(log_dir / "logs.db"), "workflow_logs")
+    else:
+        system = SegmentLogStore(str(log_dir / "system"))
+        workflow = SegmentLogStore(str(log_dir / "workflow"), index_sources=True)
+
+    assert system.count() == expected["system"]
+    assert workflow.count() == sum(n for source, n in expected.items() if source != "system")
+    for source in SOURCES:
+        assert workflow.count(source) == expected[source]
+    for store in (system, workflow):
+        ids = [entry["id"] for entry in store.iter_entries()]
+        assert len(set(ids)) == len(ids)
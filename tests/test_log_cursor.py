@@ -0,0 +1,62 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.log_store import SegmentLogStore
+from app.models.log_sqlite import SQLiteLogStore
+
+
+def _jittered_entries(count: int):
+    """时间与写入顺序不一致的日志：每条日志的时间在写入时间前后随机偏移最多2秒"""
+    rng = random.Random(42)
+    start = datetime(2026, 1, 1)
+    entries = []
+    for i in range(count):
+        timestamp = start + timedelta(milliseconds=10 * i + rng.randint(-2000, 2000))
+        entries.append({
+            "id": f"log-{i}",
+            "timestamp": timestamp.isoformat(),
+            "level": "info",
+            "source": "wf" if i % 2 else "other",
+            "message": f"message {i}",
+        })
+    return entries
+
+
+@pytest.fixture(params=["segment", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "segment":
+        # 分段较小，游标会跨越多个分段
+        yield SegmentLogStore(str(tmp_path / "logs"), segment_max_bytes=8 * 1024)
+        return
+    store = SQLiteLogStore(str(tmp_path / "logs.db"), "workflow_logs")
+    yield store
+    store.close()
+
+
+def _page_all(store, source=None, page_size=37):
+    ids = []
+    cursor = None
+    for _ in range(1000):
+        logs, total, positions = store.query_before(source, None, cursor, page_size)
+        ids.extend(entry["id"] for entry in logs)
+        if len(logs) < page_size:
+            return ids, total
+        last = logs[-1]
+        cursor = (last["timestamp"], last["id"], positions[-1])
+    pytest.fail("游标分页没有结束")
+
+
+@pytest.mark.parametrize("source", [None, "wf"])
+def test_cursor_paging_with_out_of_order_timestamps(store, source):
+    entries = _jittered_entries(1000)
+    for i in range(0, len(entries), 100):
+        store.append_many(entries[i:i + 100])
+
+    ids, total = _page_all(store, source)
+
+    expected = [entry["id"] for entry in entries if source is None or entry["source"] == source]
+    assert total == len(expected)
+    assert len(ids) == len(expected)
+    assert set(ids) == set(expected)